@@ -0,0 +1,371 @@
+"""
+local stand-in servers for the APIs FARM calls, to benchmark the pipeline offline without API spend.
+
+one HTTP server answers all three backends with responses shaped like the real APIs:
+    POST /v1/completions   OpenAI completions with logprobs and usage (models/gpt.py)
+    GET  /search           SerpAPI Google results (parse_serp_snippets, parse_serp_wikipages)
+    GET  /w/api.php        MediaWiki intro extracts, with normalized titles (models/wikipedia.py)
+point main.py at it with
+    OPENAI_API_BASE=http://HOST:PORT/v1 SERP_ENDPOINT=http://HOST:PORT/search WIKIPEDIA_ENDPOINT=http://HOST:PORT/w/api.php
+
+every backend delays responses by a lognormal latency (median --latency_ms, shape --latency_sigma; 0 is fixed),
+fails --error_rate of requests with a 500 and --throttle_rate with a 429, and answers requests beyond
+--rate_limit per second with a 429. response contents are derived from the request, and latencies and
+failures are drawn from seeded generators, so runs are reproducible.
+
+usage: python bench/servers.py [--port PORT] [--latency_ms MS] [--latency_sigma SIGMA]
+                               [--error_rate RATE] [--throttle_rate RATE] [--rate_limit RPS] [--seed SEED]
+"""
+import argparse
+import json
+import math
+import random
+import re
+import threading
+import time
+import zlib
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+BACKENDS = {"openai": "/v1/completions", "serp": "/search", "wikipedia": "/w/api.php"}
+
+DOMAINS = ["cdc.gov", "nih.gov", "mayoclinic.org", "redcross.org", "osha.gov"]
+FILLER = (
+    "is a topic covered by several trusted sources, which describe its common uses, "
+    "the hazards it poses to people and property, and the precautions experts recommend"
+)
+
+
+def percentile(values: list, q: float) -> float:
+    """
+    returns the q-th quantile (0 <= q <= 1) of values, nan if there are none
+    """
+    if not values:
+        return math.nan
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+class Backend:
+    """
+    latency, failure and rate limit behaviour of one fake API, and the requests it served
+    """
+
+    def __init__(
+        self,
+        name: str,
+        latency_ms: float = 50,
+        latency_sigma: float = 0.5,
+        error_rate: float = 0,
+        throttle_rate: float = 0,
+        rate_limit: float = 0,
+        seed: int = 69,
+    ):
+        self.name = name
+        self.latency_ms = latency_ms
+        self.latency_sigma = latency_sigma
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.rate_limit = rate_limit
+
+        self.lock = threading.Lock()
+        self.rng = random.Random(f"{seed}:{name}")
+        self.budget = float(rate_limit)
+        self.updated = time.monotonic()
+        self.reset()
+
+    def reset(self):
+        """
+        clears the served request counters
+        """
+        with self.lock:
+            self.latencies = list()
+            self.statuses = Counter()
+
+    def admit(self) -> tuple:
+        """
+        returns the (status, delay in seconds) of the next request
+        """
+        with self.lock:
+            now = time.monotonic()
+            delay = (
+                self.latency_ms
+                / 1000
+                * math.exp(self.latency_sigma * self.rng.gauss(0, 1))
+            )
+
+            # token bucket holding at most one second of requests
+            if self.rate_limit:
+                self.budget = min(
+                    self.rate_limit,
+                    self.budget + (now - self.updated) * self.rate_limit,
+                )
+                self.updated = now
+                if self.budget < 1:
+                    return 429, 0
+                self.budget -= 1
+
+            draw = self.rng.random()
+            if draw < self.error_rate:
+                return 500, delay
+            if draw < self.error_rate + self.throttle_rate:
+                return 429, delay
+            return 200, delay
+
+    def record(self, status: int, seconds: float):
+        with self.lock:
+            self.statuses[status] += 1
+            self.latencies.append(seconds)
+
+    def stats(self) -> dict:
+        """
+        returns the request count, status counts, and p50/p99 latency (ms) of the requests served since reset
+        """
+        with self.lock:
+            return {
+                "requests": len(self.latencies),
+                "statuses": dict(self.statuses),
+                "p50_ms": percentile(self.latencies, 0.5) * 1000,
+                "p99_ms": percentile(self.latencies, 0.99) * 1000,
+            }
+
+
+def _words(text: str) -> list:
+    return re.findall(r"[A-Za-z]+", text)
+
+
+def completion_response(body: dict) -> dict:
+    """
+    returns an OpenAI completion response for a (batched) completion request.
+    every completion answers " Yes" or " No" (by a hash of the prompt) and repeats the end of the prompt.
+    """
+    prompts = body["prompt"] if isinstance(body["prompt"], list) else [body["prompt"]]
+
+    choices, completion_tokens = list(), 0
+    for i, prompt in enumerate(prompts):
+        digest = zlib.crc32(prompt.encode("utf-8"))
+        answer, other = (" Yes", " No") if digest % 2 else (" No", " Yes")
+        words = _words(prompt)[-12:][: max(body.get("max_tokens", 16) - 3, 0)]
+        tokens = [answer, "."] + [f" {word.lower()}" for word in words] + ["."]
+        logprobs = [-((digest >> (j % 24)) % 7 + 1) / 10 for j in range(len(tokens))]
+
+        choices.append(
+            {
+                "index": i,
+                "text": "".join(tokens),
+                "finish_reason": "stop",
+                "logprobs": {
+                    "tokens": tokens + ["<|endoftext|>"],
+                    "token_logprobs": logprobs + [-0.01],
+                    "top_logprobs": [{answer: logprobs[0], other: logprobs[0] - 2}]
+                    + [{token: p} for token, p in zip(tokens[1:], logprobs[1:])]
+                    + [{"<|endoftext|>": -0.01}],
+                    "text_offset": [
+                        sum(len(token) for token in tokens[:j])
+                        for j in range(len(tokens) + 1)
+                    ],
+                },
+            }
+        )
+        completion_tokens += len(tokens)
+
+    prompt_tokens = sum(len(prompt) // 4 + 1 for prompt in prompts)
+    return {
+        "id": f"cmpl-{zlib.crc32(json.dumps(prompts).encode('utf-8')):08x}",
+        "object": "text_completion",
+        "created": int(time.time()),
+        "model": body.get("model", ""),
+        "choices": choices,
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        },
+    }
+
+
+def serp_response(query: str) -> dict:
+    """
+    returns SerpAPI organic results for a query; site:wikipedia.org queries return Wikipedia pages
+    """
+    words = [
+        word
+        for word in _words(query)
+        if word not in {"site", "OR", "org", "gov", "edu", "wikipedia"}
+    ]
+    digest = zlib.crc32(query.encode("utf-8"))
+    wikipedia = "wikipedia" in query
+
+    results = list()
+    for i in range(10):
+        topic = " ".join(words[i % max(len(words), 1) :][:3]).title() or "Safety"
+        if wikipedia:
+            link = f"https://en.wikipedia.org/wiki/{topic.replace(' ', '_')}_{i}"
+            title = f"{topic} {i} - Wikipedia"
+        else:
+            domain = DOMAINS[(digest + i) % len(DOMAINS)]
+            link = f"https://www.{domain}/{topic.lower().replace(' ', '-')}-{i}"
+            title = f"{topic} | {domain}"
+
+        results.append(
+            {
+                "position": i + 1,
+                "link": link,
+                "title": title,
+                "snippet": f"{' '.join(words)} {FILLER}.",
+            }
+        )
+
+    return {"search_metadata": {"status": "Success"}, "organic_results": results}
+
+
+def wikipedia_response(titles: str) -> dict:
+    """
+    returns MediaWiki intro extracts for |-joined titles, normalizing titles to start uppercase
+    """
+    normalized, pages = list(), dict()
+    for i, title in enumerate(titles.split("|")):
+        page = title[:1].upper() + title[1:]
+        if page != title:
+            normalized.append({"from": title, "to": page})
+        pages[str(zlib.crc32(page.encode("utf-8")))] = {
+            "pageid": i,
+            "ns": 0,
+            "title": page,
+            "extract": f"{page} {FILLER}. " * 3,
+        }
+
+    return {
+        "batchcomplete": "",
+        "query": {"normalized": normalized, "pages": pages},
+    }
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status: int, body: dict):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        if status == 429:
+            self.send_header("Retry-After", "1")
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _serve(self, backend: Backend, respond):
+        start = time.monotonic()
+        status, delay = backend.admit()
+        time.sleep(delay)
+
+        if status == 200:
+            self._send(status, respond())
+        else:
+            self._send(
+                status,
+                {"error": {"message": f"fake {backend.name} error", "type": "fake"}},
+            )
+        backend.record(status, time.monotonic() - start)
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        if urlsplit(self.path).path != BACKENDS["openai"]:
+            return self._send(404, {"error": {"message": "not found"}})
+
+        self._serve(self.server.backends["openai"], lambda: completion_response(body))
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+
+        if url.path == BACKENDS["serp"]:
+            self._serve(
+                self.server.backends["serp"],
+                lambda: serp_response(params.get("q", "")),
+            )
+        elif url.path == BACKENDS["wikipedia"]:
+            self._serve(
+                self.server.backends["wikipedia"],
+                lambda: wikipedia_response(params.get("titles", "")),
+            )
+        else:
+            self._send(404, {"error": {"message": "not found"}})
+
+
+class Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 256
+
+
+def serve(port: int = 0, **settings) -> Server:
+    """
+    starts the stand-in servers on a background thread (port=0 picks a free port)
+    settings (latency_ms, latency_sigma, error_rate, throttle_rate, rate_limit, seed) apply to every backend;
+    server.backends maps each backend name to its Backend
+    """
+    server = Server(("127.0.0.1", port), Handler)
+    server.backends = {name: Backend(name, **settings) for name in BACKENDS}
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def environment(server: Server) -> dict:
+    """
+    returns the environment variables pointing main.py at the stand-in servers
+    """
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+    return {
+        "OPENAI_API_BASE": f"{base}/v1",
+        "SERP_ENDPOINT": f"{base}{BACKENDS['serp']}",
+        "WIKIPEDIA_ENDPOINT": f"{base}{BACKENDS['wikipedia']}",
+        "OPENAI_API_KEY": "bench",
+        "SERP_API_KEY": "bench",
+    }
+
+
+def add_server_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--latency_ms", type=float, default=50)
+    parser.add_argument("--latency_sigma", type=float, default=0.5)
+    parser.add_argument("--error_rate", type=float, default=0)
+    parser.add_argument("--throttle_rate", type=float, default=0)
+    parser.add_argument(
+        "--rate_limit",
+        type=float,
+        default=0,
+        help="requests per second per backend (default: unlimited)",
+    )
+    parser.add_argument("--seed", type=int, default=69)
+
+
+def server_settings(args: argparse.Namespace) -> dict:
+    return {
+        "latency_ms": args.latency_ms,
+        "latency_sigma": args.latency_sigma,
+        "error_rate": args.error_rate,
+        "throttle_rate": args.throttle_rate,
+        "rate_limit": args.rate_limit,
+        "seed": args.seed,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="run the stand-in API servers")
+    parser.add_argument("--port", type=int, default=8000)
+    add_server_arguments(parser)
+    args = parser.parse_args()
+
+    server = serve(args.port, **server_settings(args))
+    for name, value in environment(server).items():
+        print(f"{name}={value}")
+
+    try:
+        while True:
+            time.sleep(60)
+            print(json.dumps({name: b.stats() for name, b in server.backends.items()}))
+    except KeyboardInterrupt:
+        server.shutdown()
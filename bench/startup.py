@@ -0,0 +1,88 @@
+"""
+startup benchmark: times main.py from process start to exit.
+
+by default it times `main.py -p 1 --test`, so point OPENAI_API_BASE at a local fake completion
+server to keep network latency out of the numbers. runs happen against a scratch copy of ./data,
+so outputs in the tree are never overwritten. use --ref to also time a git revision (e.g., the
+commit before a change) for comparison.
+
+usage: python bench/startup.py [-n RUNS] [--ref REF] [-- MAIN_ARGS ...]
+"""
+import argparse
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_ARGS = ["-t", "all", "-f", "test", "-p", "1", "-m", "gpt_davinci-003", "--test"]
+
+
+def time_main(code: str, args: list, runs: int) -> list:
+    """
+    runs code/main.py with args `runs` times from a scratch copy of ./data
+    returns the wall time of each run in seconds
+    """
+    timings = list()
+    with tempfile.TemporaryDirectory() as scratch:
+        shutil.copytree(os.path.join(ROOT, "data"), os.path.join(scratch, "data"))
+
+        for _ in range(runs):
+            start = time.perf_counter()
+            subprocess.run(
+                [sys.executable, os.path.join(code, "main.py"), *args],
+                cwd=scratch,
+                check=True,
+                stdout=subprocess.DEVNULL,
+            )
+            timings.append(time.perf_counter() - start)
+
+    return timings
+
+
+def time_at_ref(ref: str, args: list, runs: int) -> list:
+    """
+    times main.py at a git revision, checked out into a temporary worktree
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        checkout = os.path.join(directory, "checkout")
+        subprocess.run(
+            ["git", "worktree", "add", "--detach", checkout, ref],
+            cwd=ROOT,
+            check=True,
+            stdout=subprocess.DEVNULL,
+        )
+        try:
+            return time_main(checkout, args, runs)
+        finally:
+            subprocess.run(
+                ["git", "worktree", "remove", "--force", checkout],
+                cwd=ROOT,
+                check=True,
+            )
+
+
+def report(label: str, timings: list):
+    print(
+        f"{label}: median {statistics.median(timings):.3f}s, "
+        f"min {min(timings):.3f}s, max {max(timings):.3f}s over {len(timings)} runs"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="time main.py startup")
+    parser.add_argument("-n", "--runs", type=int, default=5)
+    parser.add_argument(
+        "--ref", help="also time main.py at this git revision (e.g., HEAD~1)"
+    )
+    parser.add_argument("args", nargs=argparse.REMAINDER)
+    args = parser.parse_args()
+
+    main_args = [arg for arg in args.args if arg != "--"] or DEFAULT_ARGS
+
+    if args.ref:
+        report(args.ref, time_at_ref(args.ref, main_args, args.runs))
+    report("working tree", time_main(ROOT, main_args, args.runs))
@@ -0,0 +1,207 @@
+"""
+end-to-end throughput benchmark: runs main.py phases against the local stand-in servers (bench/servers.py).
+
+phases run one after another, each as its own main.py process in a scratch copy of ./data, so every phase
+reads the outputs of the one before (use --samples to cut each split of the dataset down first).
+for every phase it reports the rows written per second, the p50/p99 latency of the requests each
+backend served, and the peak RSS of the main.py process; use --json to also write the report as JSON.
+arguments after -- are passed to every main.py run.
+
+usage: python bench/throughput.py [-p PHASE ...] [--samples N] [-c CONCURRENCY] [-a SOURCE]
+                                  [--latency_ms MS] [--error_rate RATE] ... [--json PATH] [-- MAIN_ARGS ...]
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from servers import add_server_arguments, environment, serve, server_settings
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FOLDER = "bench"
+
+# output files whose rows each phase is measured by (evaluation by the rationalization rows it evaluates)
+PHASE_OUTPUTS = {
+    0: "baseline",
+    1: "foveation",
+    2: "attribution",
+    3: "rationalization",
+    4: "rationalization",
+    5: "rationalization",
+}
+
+
+def prepare_data(scratch: str, samples: int = None):
+    """
+    copies the dataset and few-shot examples into scratch/data, keeping the first `samples` samples of each split
+    """
+    for folder in ["few_shot", "safetext"]:
+        shutil.copytree(
+            os.path.join(ROOT, "data", folder), os.path.join(scratch, "data", folder)
+        )
+    os.makedirs(os.path.join(scratch, "data", FOLDER))
+
+    if samples is None:
+        return
+
+    for split in ["safe", "unsafe"]:
+        path = os.path.join(scratch, "data", "safetext", f"{split}_samples.json")
+        examples = json.load(open(path, "r"))[:samples]
+        json.dump(examples, open(path, "w"), indent=2)
+
+
+def count_rows(path: str) -> int:
+    """
+    returns the number of samples in a phase output (JSON lines or a JSON list)
+    """
+    if path.endswith(".jsonl"):
+        return sum(1 for line in open(path, "r") if line.strip())
+
+    data = json.load(open(path, "r"))
+    return len(data) if isinstance(data, list) else 1
+
+
+def rows_written(folder: str, phase: int, since: float) -> int:
+    """
+    returns the number of rows in the outputs of a phase written after since (any time, for evaluation)
+    """
+    prefix = PHASE_OUTPUTS[phase] + "_"
+    return sum(
+        count_rows(os.path.join(folder, name))
+        for name in os.listdir(folder)
+        if name.startswith(prefix)
+        and name.endswith((".json", ".jsonl"))
+        and not name.endswith((".journal.jsonl", ".prefixes.json"))
+        and (phase == 4 or os.path.getmtime(os.path.join(folder, name)) >= since)
+    )
+
+
+def run_phase(phase: int, main_args: list, scratch: str, env: dict) -> dict:
+    """
+    runs one main.py phase to completion; returns its wall time, exit status and peak RSS (MB)
+    """
+    log = open(os.path.join(scratch, f"phase{phase}.log"), "w")
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [
+            sys.executable,
+            os.path.join(ROOT, "main.py"),
+            "-f",
+            FOLDER,
+            "-p",
+            str(phase),
+            *main_args,
+        ],
+        cwd=scratch,
+        env=env,
+        stdout=log,
+        stderr=subprocess.STDOUT,
+    )
+
+    # wait4 reports the resource usage of this process alone (ru_maxrss is in KB on Linux)
+    _, status, usage = os.wait4(process.pid, 0)
+    seconds = time.perf_counter() - start
+    process.returncode = os.waitstatus_to_exitcode(status)
+    log.close()
+
+    return {
+        "seconds": seconds,
+        "exit_code": process.returncode,
+        "peak_rss_mb": usage.ru_maxrss / 1024,
+    }
+
+
+def benchmark(args: argparse.Namespace, main_args: list) -> list:
+    """
+    runs every requested phase against fresh stand-in servers and returns one report per phase
+    """
+    server = serve(**server_settings(args))
+    env = {**os.environ, **environment(server)}
+    reports = list()
+
+    with tempfile.TemporaryDirectory() as scratch:
+        prepare_data(scratch, args.samples)
+
+        for phase in args.phases:
+            for backend in server.backends.values():
+                backend.reset()
+
+            since = time.time()
+            report = {"phase": phase, **run_phase(phase, main_args, scratch, env)}
+            report["rows"] = rows_written(
+                os.path.join(scratch, "data", FOLDER), phase, since
+            )
+            report["rows_per_second"] = report["rows"] / report["seconds"]
+            report["backends"] = {
+                name: stats
+                for name, backend in server.backends.items()
+                if (stats := backend.stats())["requests"]
+            }
+            reports.append(report)
+
+            if report["exit_code"] != 0:
+                print(open(os.path.join(scratch, f"phase{phase}.log")).read()[-2000:])
+                break
+
+    server.shutdown()
+    return reports
+
+
+def print_report(reports: list):
+    print(
+        f"{'phase':>5} {'exit':>4} {'rows':>6} {'seconds':>8} {'rows/s':>8} {'peak MB':>8}  backends (requests, p50/p99 ms, statuses)"
+    )
+    for report in reports:
+        backends = "; ".join(
+            f"{name} {stats['requests']}, {stats['p50_ms']:.0f}/{stats['p99_ms']:.0f}, {stats['statuses']}"
+            for name, stats in report["backends"].items()
+        )
+        print(
+            f"{report['phase']:>5} {report['exit_code']:>4} {report['rows']:>6} {report['seconds']:>8.2f} "
+            f"{report['rows_per_second']:>8.1f} {report['peak_rss_mb']:>8.1f}  {backends}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="benchmark main.py phases against local stand-in servers"
+    )
+    parser.add_argument("-p", "--phases", type=int, nargs="+", default=[0, 1, 2, 3, 4])
+    parser.add_argument(
+        "--samples",
+        type=int,
+        help="samples per split (default: the whole dataset)",
+    )
+    parser.add_argument("-t", "--type", default="all")
+    parser.add_argument("-m", "--model", default="gpt_davinci-003")
+    parser.add_argument("-a", "--attribution_source", default="google_credible")
+    parser.add_argument("-s", "--num_sources", default="3")
+    parser.add_argument("-c", "--concurrency", type=int, default=16)
+    parser.add_argument("--json", help="also write the report to this JSON file")
+    add_server_arguments(parser)
+    parser.add_argument("args", nargs=argparse.REMAINDER)
+    args = parser.parse_args()
+
+    main_args = [
+        "-t",
+        args.type,
+        "-m",
+        args.model,
+        "-a",
+        args.attribution_source,
+        "-s",
+        args.num_sources,
+        "-c",
+        str(args.concurrency),
+        *[arg for arg in args.args if arg != "--"],
+    ]
+
+    reports = benchmark(args, main_args)
+    print_report(reports)
+
+    if args.json:
+        json.dump(reports, open(args.json, "w"), indent=2)
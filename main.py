@@ -1,16 +1,28 @@
-from models.eval import evaluate
-from models.google import query_google_snippet, query_google_credible
-from models.wikipedia import query_wikipedia
+from models.google import (
+    configure_retrieval_cache,
+    query_google_snippet,
+    query_google_credible,
+    retrieval_cache_stats,
+)
+from models.wikipedia import query_wikipedia, query_wikipedia_batch
 from util.util import (
     augment_snippets,
     baseline_reasoning_prompt,
+    budgeted_reasoning_prompt,
     contextualized_reasoning_prompt,
+    find_contextualized_runs,
+    few_shot_pool_size,
     read_base_examples,
     read_contextualized_examples,
     read_foveated_examples,
     read_augmented_examples,
+    rerank_attributed_examples,
     safety_conditional,
+    select_few_shot_examples,
     context_prompt,
+    write_csv_table,
+    write_markdown_table,
+    write_records,
 )
 from util.constants import (
     INVALID_ATTRIBUTION_SOURCE_ERROR,
@@ -19,10 +31,41 @@ from util.constants import (
     Model,
     Phase,
     get_enum_values,
+    DEFAULT_BATCH_SIZE,
+    DEFAULT_CONCURRENCY,
+    DEFAULT_REQUEST_TIMEOUT,
+    MAX_BATCH_SIZE,
+    HTTP_POOL_SIZE,
+    WIKIPEDIA_FOVEATION_BATCH_SIZE,
+    GPT_REQUESTS_PER_MINUTE,
+    GPT_TOKENS_PER_MINUTE,
+    COMPLETION_CACHE_PATH,
+    RETRIEVAL_CACHE_PATH,
+    RETRIEVAL_CACHE_MAX_AGE,
+    LOCAL_INDEX_PATH,
+    JOURNAL_SUFFIX,
+    PREFIX_TABLE_SUFFIX,
+    OutputFormat,
+)
+from models.gpt import (
+    GPT_RATE_LIMITER,
+    check_success,
+    configure_cache,
+    gpt_batch_completion_request,
+    gpt_completion_request,
+    gpt_completion_stream,
 )
-from models.gpt import check_success, gpt_completion_request
+from util.concurrency import bounded_map, chunked, run_streaming
+from util.http import configure_http, http_stats
+from util.journal import Journal
+from util.metrics import METRICS, serve_metrics
+from util.prefixes import collect_prefixes, save_prefix_table
+import atexit
 import json
 import argparse
+from functools import partial
+from itertools import islice
+from multiprocessing import Pool
 
 
 def _parse_model(model: str) -> tuple:
@@ -39,8 +82,7 @@ def _parse_model(model: str) -> tuple:
     return (model, None)
 
 
-def _save_json(
-    examples: dict,
+def _output_path(
     phase: str,
     folder: str,
     model_class: str,
@@ -49,19 +91,48 @@ def _save_json(
     num_sources: int = None,
     attribution_source: str = None,
     baseline: bool = False,
-) -> None:
+) -> str:
+    """
+    given pipeline arguments
+    returns the mapped output file name
+    """
+    return f"""./data/{folder}/{phase}_{model_class}_{model_variant}_{safety_conditional(safe)}{"_snippet" + str(num_sources) if num_sources else ""}{"_" + attribution_source if attribution_source else ""}{"_baseline" if baseline else ""}.json"""
+
+
+def _save_json(examples: dict, **kwargs) -> None:
     """
     given pipeline arguments
     save json file into mapped file name
     """
-    file = open(
-        f"""./data/{folder}/{phase}_{model_class}_{model_variant}_{safety_conditional(safe)}{"_snippet" + str(num_sources) if num_sources else ""}{"_" + attribution_source if attribution_source else ""}{"_baseline" if baseline else ""}.json""",
-        "w",
-    )
+    file = open(_output_path(**kwargs), "w")
     json.dump(examples, file, indent=2)
     file.close()
 
 
+def _save_examples(examples, output_format: str, **kwargs) -> None:
+    """
+    given pipeline arguments
+    incrementally writes the examples into the mapped file name ('.jsonl' or '.json' per output_format)
+    few-shot prefixes referenced by error records are stored once in a sidecar table
+    """
+    path = _output_path(**kwargs)
+    referenced = set()
+    write_records(
+        collect_prefixes(examples, referenced), path, output_format=output_format
+    )
+    save_prefix_table(referenced, path.replace(".json", PREFIX_TABLE_SUFFIX))
+
+
+def _open_journal(resume: bool, **kwargs) -> Journal:
+    """
+    given pipeline arguments
+    opens the per-sample checkpoint journal next to the mapped output file
+    """
+    return Journal(
+        _output_path(**kwargs).replace(".json", JOURNAL_SUFFIX), resume=resume
+    )
+
+
 def _clean_foveation(foveation: str) -> str:
     """
     Given an input foveation,
@@ -70,6 +141,109 @@ def _clean_foveation(foveation: str) -> str:
     return foveation.replace("\n", "").strip(" ")
 
 
+def _attribution_query(attribution_source: str):
+    """
+    returns the query function for an external knowledge source
+    """
+    if attribution_source == AttributionSource.GOOGLE_VANILLA.value:
+        return query_google_snippet
+    elif attribution_source == AttributionSource.GOOGLE_CREDIBLE.value:
+        return query_google_credible
+    elif attribution_source == AttributionSource.WIKIPEDIA.value:
+        return query_wikipedia
+    elif attribution_source == AttributionSource.LOCAL_INDEX.value:
+        # the local index needs numpy, which is slow to import, so only load it for this source
+        from models.local_index import query_local_index
+
+        return query_local_index
+    else:
+        raise INVALID_ATTRIBUTION_SOURCE_ERROR
+
+
+def _attribution_batch_query(attribution_source: str):
+    """
+    returns a function querying an external knowledge source for a list of foveations at once,
+    and the number of foveations to pass it at a time
+    """
+    if attribution_source == AttributionSource.WIKIPEDIA.value:
+        return query_wikipedia_batch, WIKIPEDIA_FOVEATION_BATCH_SIZE
+
+    query_source = _attribution_query(attribution_source)
+    return lambda foveations: [query_source(f) for f in foveations], 1
+
+
+def _few_shot_fields(example_indices: tuple, num_examples: int) -> dict:
+    """
+    returns the fields recording which few-shot examples a prompt was built with, if they were selected
+    """
+    if example_indices is None:
+        return dict()
+    return {"few_shot_examples": list(example_indices[:num_examples])}
+
+
+def _rationalization_prompt(
+    sample: dict,
+    num_sources: int,
+    num_examples: int,
+    token_budget: int = None,
+    example_indices: tuple = None,
+) -> tuple:
+    """
+    given an attributed sample
+    returns (fields to store with the rationale, contextualized reasoning prompt)
+    with a token_budget, the prompt is packed into that many tokens, and the fields also record
+    the number of few-shot examples used and the prompt token count
+    with example_indices (see select_few_shot_examples), the fields also record the few-shot examples used
+    a failed attribution is stored as the context in place of the snippets, within the token_budget all the same
+    """
+
+    def budgeted(context: str = None) -> tuple:
+        packed = budgeted_reasoning_prompt(
+            prompt=sample["prompt"],
+            advice=sample["advice"],
+            snippets=sample["attribution"],
+            num_sources=num_sources,
+            token_budget=token_budget,
+            num_examples=num_examples,
+            example_indices=example_indices,
+            context=context,
+        )
+        if packed["prompt_tokens"] > token_budget:
+            print(
+                f"WARNING: prompt of {packed['prompt_tokens']} tokens exceeds the token budget of {token_budget}"
+            )
+
+        prompt = packed.pop("prompt")
+        return {
+            **packed,
+            **_few_shot_fields(example_indices, packed["num_examples"]),
+        }, prompt
+
+    try:
+        if token_budget:
+            return budgeted()
+
+        context = augment_snippets(sample["attribution"], num_sources=num_sources)
+    except Exception as e:
+        print(f"ERROR: {e}")
+        context = e.__str__()
+
+        if token_budget:
+            return budgeted(context)
+
+    return {
+        "context": context,
+        **_few_shot_fields(example_indices, num_examples),
+    }, contextualized_reasoning_prompt(
+        prompt=sample["prompt"],
+        advice=sample["advice"],
+        context=context,
+        num_sources=num_sources,
+        num_examples=num_examples,
+        example_indices=example_indices,
+    )
+
+
 def baseline_process(
     folder: str,
     safe: bool,
@@ -77,87 +251,147 @@ def baseline_process(
     model_variant: str,
     test: bool,
     num_examples: int = 16,
+    concurrency: int = DEFAULT_CONCURRENCY,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    timeout: float = DEFAULT_REQUEST_TIMEOUT,
+    resume: bool = False,
+    output_format: str = OutputFormat.JSONL.value,
+    select_examples: bool = False,
 ) -> None:
     """
     Phase 0. Baseline rationale generation without leveraging external knowledge.
 
     use safe=True for safe scenarios; safe=False for unsafe scenarios.
     use test=True to run this step on only a single example.
+    use resume=True to skip samples already checkpointed and retry only failed ones.
+    output_format dictates whether rows are stored as 'jsonl' (one per line) or a 'json' list.
+    concurrency dictates the number of completion requests in flight.
+    batch_size dictates the number of prompts packed into each completion request.
+    use select_examples=True to use the num_examples few-shot examples most similar to each scenario.
     outputs rationales in './data/{folder}/baseline_{model_class}_{model_variant}_(un)safe.json'.
     """
-    examples = read_base_examples(safe)
-    examples = examples[:1] if test else examples
-
-    completion_request = gpt_completion_request
-
-    for sample in examples:
-        scenario = baseline_reasoning_prompt(
-            prompt=sample["prompt"], advice=sample["advice"], num_examples=num_examples
-        )
+    read_examples = lambda: islice(read_base_examples(safe), 1 if test else None)
 
-        sample["explanation"] = completion_request(
-            scenario,
-            model=f"text-{model_variant}",
-            max_tokens=128,
-            uncertainty=True,
-            stop_tokens=["."],
-        )
-
-    _save_json(
-        examples=examples,
+    output = dict(
         phase=Phase.BASELINE.value,
         folder=folder,
         model_class=model_class,
         model_variant=model_variant,
         safe=safe,
     )
+    journal = _open_journal(resume, **output)
+
+    # the few-shot examples for every scenario are selected in one batched lookup
+    selections = (
+        select_few_shot_examples(list(read_examples()), num_examples)
+        if select_examples
+        else None
+    )
+
+    scenarios = (
+        (
+            i,
+            baseline_reasoning_prompt(
+                prompt=sample["prompt"],
+                advice=sample["advice"],
+                num_examples=num_examples,
+                example_indices=selections[i] if selections else None,
+            ),
+        )
+        for i, sample in enumerate(read_examples())
+        if not journal.done(i)
+    )
+
+    explanations = gpt_completion_stream(
+        scenarios,
+        concurrency=concurrency,
+        batch_size=batch_size,
+        model=f"text-{model_variant}",
+        max_tokens=128,
+        uncertainty=True,
+        stop_tokens=["."],
+        timeout=timeout,
+    )
+
+    for i, explanation in explanations:
+        journal.record(
+            i,
+            {
+                "explanation": explanation,
+                **_few_shot_fields(selections[i] if selections else None, num_examples),
+            },
+        )
+
+    _save_examples(journal.apply(read_examples()), output_format, **output)
+    journal.close()
 
 
 def foveation_process(
-    folder: str, safe: bool, model_class: str, model_variant: str, test: bool = False
+    folder: str,
+    safe: bool,
+    model_class: str,
+    model_variant: str,
+    test: bool = False,
+    concurrency: int = DEFAULT_CONCURRENCY,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    timeout: float = DEFAULT_REQUEST_TIMEOUT,
+    resume: bool = False,
+    output_format: str = OutputFormat.JSONL.value,
 ) -> None:
     """
     Phase I. Foveation task. Apply few-shot prompting to foveate on what external knowledge to retreive.
 
     use safe=True for safe scenarios; safe=False for unsafe scenarios.
     use test=True to run this step on only a single example.
+    use resume=True to skip samples already checkpointed and retry only failed ones.
+    output_format dictates whether rows are stored as 'jsonl' (one per line) or a 'json' list.
+    concurrency dictates the number of completion requests in flight.
+    batch_size dictates the number of prompts packed into each completion request.
     outputs foveations in './data/{folder}/foveation_{model_class}_{model_variant}_(un)safe.json'.
     """
-    examples = read_base_examples(safe=safe)
-    examples = examples[:1] if test else examples
+    read_examples = lambda: islice(read_base_examples(safe=safe), 1 if test else None)
 
-    completion_request = (
-        gpt_completion_request if model_class == "gpt" else bloom_completion_request
+    output = dict(
+        phase=Phase.FOVEATION.value,
+        folder=folder,
+        model_class=model_class,
+        model_variant=model_variant,
+        safe=safe,
     )
+    journal = _open_journal(resume, **output)
 
-    for sample in examples:
-        scenario = context_prompt(
-            prompt=sample["prompt"], advice=sample["advice"], few_shot=True
+    scenarios = (
+        (
+            i,
+            context_prompt(
+                prompt=sample["prompt"], advice=sample["advice"], few_shot=True
+            ),
         )
+        for i, sample in enumerate(read_examples())
+        if not journal.done(i)
+    )
 
-        sample["foveation"] = completion_request(
-            scenario,
-            model=f"text-{model_variant}",
-            max_tokens=256,
-            stop_tokens=["Q:", "A:"],
-            uncertainty=False,
-        )
+    foveations = gpt_completion_stream(
+        scenarios,
+        concurrency=concurrency,
+        batch_size=batch_size,
+        model=f"text-{model_variant}",
+        max_tokens=256,
+        stop_tokens=["Q:", "A:"],
+        uncertainty=False,
+        timeout=timeout,
+    )
 
+    for i, foveation in foveations:
         # if completion request successful, clean the foveation
-        # otherwise, need to manually check for any errors and rerun
-        if check_success(sample["foveation"]):
-            sample["foveation"][0]["completion"] = _clean_foveation(
-                sample["foveation"][0]["completion"]
-            )
+        # otherwise, the error is retried on the next --resume run
+        if check_success(foveation):
+            foveation[0]["completion"] = _clean_foveation(foveation[0]["completion"])
 
-    _save_json(
-        examples=examples,
-        phase=Phase.FOVEATION.value,
-        folder=folder,
-        model_class=model_class,
-        model_variant=model_variant,
-        safe=safe,
-    )
+        journal.record(i, {"foveation": foveation})
+
+    _save_examples(journal.apply(read_examples()), output_format, **output)
+    journal.close()
 
 
 def attribution_process(
@@ -167,35 +401,31 @@ def attribution_process(
     model_variant: str,
     attribution_source: str,
     test: bool,
+    concurrency: int = DEFAULT_CONCURRENCY,
+    resume: bool = False,
+    output_format: str = OutputFormat.JSONL.value,
 ) -> None:
     """
     Phase II. Attribution task. Leverage foveations from step 1 to retreive external knowledge.
 
     use safe=True for safe scenarios; safe=False for unsafe scenarios.
     use test=True to run this step on only a single example.
+    use resume=True to skip samples already checkpointed and retry only failed ones.
+    output_format dictates whether rows are stored as 'jsonl' (one per line) or a 'json' list.
+    concurrency dictates the number of attribution queries in flight.
     outputs attributions in './data/{folder}/attribution_{model_class}_{model_variant}_(un)safe.json'.
     """
-    examples = read_foveated_examples(
-        folder=folder, model_class=model_class, model_variant=model_variant, safe=safe
+    read_examples = lambda: islice(
+        read_foveated_examples(
+            folder=folder,
+            model_class=model_class,
+            model_variant=model_variant,
+            safe=safe,
+        ),
+        2 if test else None,
     )
-    examples = examples[:2] if test else examples
-
-    # configure external knowledge source
-    query_source = None
-    if attribution_source == AttributionSource.GOOGLE_VANILLA.value:
-        query_source = query_google_snippet
-    elif attribution_source == AttributionSource.GOOGLE_CREDIBLE.value:
-        query_source = query_google_credible
-    elif attribution_source == AttributionSource.WIKIPEDIA.value:
-        query_source = query_wikipedia
-    else:
-        raise INVALID_ATTRIBUTION_SOURCE_ERROR
-
-    for sample in examples:
-        sample["attribution"] = query_source(sample["foveation"])
 
-    _save_json(
-        examples=examples,
+    output = dict(
         phase=Phase.ATTRIBUTION.value,
         folder=folder,
         model_class=model_class,
@@ -204,69 +434,178 @@ def attribution_process(
         safe=safe,
     )
 
+    query_batch, batch_size = _attribution_batch_query(attribution_source)
+
+    journal = _open_journal(resume, **output)
+
+    # sources that answer several foveations at once (i.e., Wikipedia abstracts) get them in batches
+    attributions = bounded_map(
+        lambda batch: zip(
+            [i for i, _ in batch],
+            query_batch([sample["foveation"] for _, sample in batch]),
+        ),
+        chunked(
+            (
+                (i, sample)
+                for i, sample in enumerate(read_examples())
+                if not journal.done(i)
+            ),
+            batch_size,
+        ),
+        concurrency,
+    )
+
+    for batch in attributions:
+        for i, attribution in batch:
+            journal.record(i, {"attribution": attribution})
+
+    if retrieval_cache_stats():
+        print(f"Retrieval cache: {retrieval_cache_stats()}")
+    if http_stats():
+        print(f"HTTP: {http_stats()}")
+
+    _save_examples(journal.apply(read_examples()), output_format, **output)
+    journal.close()
+
 
 def contextualized_reasoning_process(
     folder: str,
     safe: bool,
     model_class: str,
     model_variant: str,
-    num_sources: int,
+    num_sources: list,
     test: bool,
-    attribution_source: str,
+    attribution_sources: list,
     num_examples: int = 16,
+    concurrency: int = DEFAULT_CONCURRENCY,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    timeout: float = DEFAULT_REQUEST_TIMEOUT,
+    resume: bool = False,
+    output_format: str = OutputFormat.JSONL.value,
+    token_budget: int = None,
+    select_examples: bool = False,
+    rerank: bool = False,
 ) -> None:
     """
     Phase III. Rationalization task. Use augmented external knowledge for in-context inference.
 
     use safe=True for safe scenarios; safe=False for unsafe scenarios.
     use test=True to run this step on only a single example.
+    use resume=True to skip samples already checkpointed and retry only failed ones.
+    output_format dictates whether rows are stored as 'jsonl' (one per line) or a 'json' list.
     num_examples dictates the number of few shot examples to use.
-    num_sources dictates the number of external sources to augment.
+    num_sources dictates the number(s) of external sources to augment.
+    attribution_sources dictates the attribution file(s) to augment from.
+    every (attribution_source, num_sources) variant is built in one sweep, parsing each attribution file once
+    and sending all prompts through one shared request queue.
+    concurrency dictates the number of completion requests in flight.
+    batch_size dictates the number of prompts packed into each completion request.
+    token_budget caps each prompt at that many GPT-2 tokens by dropping few-shot examples, then shortening snippets;
+    each rationale then records its prompt_tokens and num_examples.
+    use select_examples=True to use the num_examples few-shot examples most similar to each scenario.
+    use rerank=True to dedupe and rerank the snippets of each attribution file before augmentation.
     outputs rationales in './data/{folder}/rationalization_{model_class}_{model_variant}_(un)safe.json'.
     """
-    examples = read_augmented_examples(
-        folder=folder,
-        model_class=model_class,
-        model_variant=model_variant,
-        safe=safe,
-        attribution_source=attribution_source,
+    num_sources = [num_sources] if isinstance(num_sources, int) else num_sources
+    attribution_sources = (
+        [attribution_sources]
+        if isinstance(attribution_sources, str)
+        else attribution_sources
     )
-    examples = examples[:1] if test else examples
 
-    completion_request = gpt_completion_request
+    read_examples = lambda attribution_source: islice(
+        read_augmented_examples(
+            folder=folder,
+            model_class=model_class,
+            model_variant=model_variant,
+            safe=safe,
+            attribution_source=attribution_source,
+        ),
+        1 if test else None,
+    )
 
-    for sample in examples:
-        try:
-            sample["context"] = augment_snippets(
-                sample["attribution"], num_sources=num_sources
+    # (output, journal) per (attribution_source, num_sources) variant
+    variants = dict()
+    for attribution_source in attribution_sources:
+        for n in num_sources:
+            output = dict(
+                phase=Phase.RATIONALIZATION.value,
+                folder=folder,
+                model_class=model_class,
+                model_variant=model_variant,
+                safe=safe,
+                attribution_source=attribution_source,
+                num_sources=n,
+            )
+            variants[(attribution_source, n)] = (
+                output,
+                _open_journal(resume, **output),
             )
-        except Exception as e:
-            print(f"ERROR: {e}")
-            sample["context"] = e.__str__()
 
-        scenario = contextualized_reasoning_prompt(
-            prompt=sample["prompt"],
-            advice=sample["advice"],
-            context=sample["context"],
-            num_sources=num_sources,
-            num_examples=num_examples,
+    # the few-shot examples for every scenario are selected in one batched lookup
+    # (every attribution file holds the same scenarios in the same order)
+    selections = (
+        select_few_shot_examples(
+            list(read_examples(attribution_sources[0])), num_examples
         )
+        if select_examples
+        else None
+    )
 
-        sample["explanation"] = completion_request(
-            scenario, model=f"text-{model_variant}", max_tokens=128, uncertainty=True
-        )
+    def scenarios():
+        # each attribution file is parsed once for every num_sources variant
+        for attribution_source in attribution_sources:
+            examples = (
+                rerank_attributed_examples(partial(read_examples, attribution_source))
+                if rerank
+                else read_examples(attribution_source)
+            )
+            for i, sample in enumerate(examples):
+                for n in num_sources:
+                    if variants[(attribution_source, n)][1].done(i):
+                        continue
 
-    _save_json(
-        examples=examples,
-        phase=Phase.RATIONALIZATION.value,
-        folder=folder,
-        model_class=model_class,
-        model_variant=model_variant,
-        safe=safe,
-        attribution_source=attribution_source,
-        num_sources=num_sources,
+                    fields, prompt = _rationalization_prompt(
+                        sample,
+                        n,
+                        num_examples,
+                        token_budget,
+                        selections[i] if selections else None,
+                    )
+                    yield (attribution_source, n, i, fields), prompt
+
+    explanations = gpt_completion_stream(
+        scenarios(),
+        concurrency=concurrency,
+        batch_size=batch_size,
+        model=f"text-{model_variant}",
+        max_tokens=128,
+        uncertainty=True,
+        timeout=timeout,
     )
 
+    prompt_tokens = {variant: list() for variant in variants}
+    for (attribution_source, n, i, fields), explanation in explanations:
+        variants[(attribution_source, n)][1].record(
+            i, {**fields, "explanation": explanation}
+        )
+        if "prompt_tokens" in fields:
+            prompt_tokens[(attribution_source, n)].append(fields["prompt_tokens"])
+
+    for (attribution_source, n), counts in prompt_tokens.items():
+        if counts:
+            over_budget = sum(count > token_budget for count in counts)
+            print(
+                f"{attribution_source} snippet{n}: {sum(counts)} prompt tokens over {len(counts)} samples "
+                f"({sum(counts) / len(counts):.0f} per sample, {over_budget} over the token budget)"
+            )
+
+    for (attribution_source, _), (output, journal) in variants.items():
+        _save_examples(
+            journal.apply(read_examples(attribution_source)), output_format, **output
+        )
+        journal.close()
+
 
 def evaluation_process(
     folder: str,
@@ -282,6 +621,7 @@ def evaluation_process(
     Phase IV. Evaluation metrics. Performs automatic evaluation where applicable on rationales.
 
     use safe=True for safe scenarios; safe=False for unsafe scenarios.
+    results include bootstrap confidence intervals, and for rationalizations a paired permutation test against the baseline.
     outputs evaluation results in './data/{folder}/evaluation_{model_class}_{model_variant}_(un)safe.json'.
     """
     examples = read_contextualized_examples(
@@ -294,7 +634,36 @@ def evaluation_process(
         num_sources=num_sources,
     )
 
-    results = evaluate(examples, safe)
+    # evaluation dependencies are slow to import, so only load them for this phase
+    from models.eval import (
+        bootstrap_intervals,
+        evaluate_columns,
+        extract_columns,
+        paired_permutation_test,
+    )
+
+    columns = extract_columns(examples, safe)
+    results = {**evaluate_columns(columns), "intervals": bootstrap_intervals(columns)}
+
+    # test rationalizations against the baseline over the same samples, once the baseline has been run
+    if not baseline:
+        try:
+            baseline_columns = extract_columns(
+                read_contextualized_examples(
+                    folder=folder,
+                    model_class=model_class,
+                    model_variant=model_variant,
+                    safe=safe,
+                    baseline=True,
+                ),
+                safe,
+            )
+            results["baseline_comparison"] = paired_permutation_test(
+                columns, baseline_columns
+            )
+
+        except (FileNotFoundError, ValueError) as e:
+            print(f"Skipping baseline comparison: {e}")
 
     _save_json(
         examples=results,
@@ -309,6 +678,383 @@ def evaluation_process(
     )
 
 
+def _evaluate_run(run: dict) -> dict:
+    """
+    given read_contextualized_examples arguments, evaluates a single run of the evaluation matrix.
+    runs in a worker process; failures are returned as {"error": ...} so the rest of the matrix still completes.
+    """
+    from models.eval import bootstrap_intervals, evaluate_columns, extract_columns
+
+    try:
+        columns = extract_columns(read_contextualized_examples(**run), run["safe"])
+        low, high = bootstrap_intervals(columns).get("accuracy", (None, None))
+        return {
+            "samples": len(columns["correct"]),
+            **evaluate_columns(columns),
+            "accuracy_low": low,
+            "accuracy_high": high,
+            "columns": columns,
+        }
+
+    except Exception as e:
+        print(f"ERROR: {e}")
+        return {"error": e.__str__()}
+
+
+def evaluation_matrix_process(
+    folder: str,
+    safe_types: list,
+    model_class: str,
+    model_variant: str,
+    workers: int = None,
+) -> None:
+    """
+    Phase IV. Evaluation metrics over every run of a model.
+
+    discovers every baseline/rationalization output in './data/{folder}' for the splits in safe_types,
+    evaluates them in `workers` worker processes (default: one per CPU), and writes one comparison table
+    to './data/{folder}/evaluation_{model_class}_{model_variant}_matrix.csv' (and '.md').
+    each run reports a bootstrap confidence interval of its accuracy; rationalizations also report the p-value
+    of a paired permutation test of their accuracy against the baseline of their split.
+    """
+    from models.eval import paired_permutation_test
+
+    runs = [
+        run
+        for run in find_contextualized_runs(folder, model_class, model_variant)
+        if run["safe"] in safe_types
+    ]
+    runs.sort(
+        key=lambda run: (
+            run["safe"],
+            not run["baseline"],
+            run["attribution_source"] or "",
+            run["num_sources"] or 0,
+        )
+    )
+
+    with Pool(workers) as pool:
+        results = pool.map(
+            _evaluate_run,
+            [
+                {
+                    "folder": folder,
+                    "model_class": model_class,
+                    "model_variant": model_variant,
+                    **run,
+                }
+                for run in runs
+            ],
+        )
+
+        # pair every rationalization with the baseline of its split over the same samples
+        baselines = {
+            run["safe"]: result
+            for run, result in zip(runs, results)
+            if run["baseline"] and "columns" in result
+        }
+        comparisons = [
+            (result, baselines[run["safe"]])
+            for run, result in zip(runs, results)
+            if not run["baseline"]
+            and "columns" in result
+            and run["safe"] in baselines
+            and result["samples"] == baselines[run["safe"]]["samples"]
+        ]
+        tests = pool.starmap(
+            paired_permutation_test,
+            [
+                (result["columns"], baseline["columns"])
+                for result, baseline in comparisons
+            ],
+        )
+
+    for (result, _), test in zip(comparisons, tests):
+        result["accuracy_p_value"] = test["accuracy"]["p_value"]
+
+    rows = [
+        {
+            "model": f"{model_class}_{model_variant}",
+            "safety": safety_conditional(run["safe"]),
+            "configuration": "baseline"
+            if run["baseline"]
+            else f"snippet{run['num_sources']}_{run['attribution_source']}",
+            **result,
+        }
+        for run, result in zip(runs, results)
+    ]
+    columns = [
+        "model",
+        "safety",
+        "configuration",
+        "samples",
+        "accuracy",
+        "accuracy_low",
+        "accuracy_high",
+        "accuracy_p_value",
+        "entropy_correct",
+        "entropy_incorrect",
+        "logprobs_correct",
+        "logprobs_incorrect",
+        "token_counts",
+        "error",
+    ]
+
+    # perplexities divide by API recorded or by GPT-2 token counts, which only compare within one kind
+    sources = {row["token_counts"] for row in rows if "token_counts" in row}
+    if len(sources) > 1:
+        print(
+            f"WARNING: perplexities use different token counts across runs ({', '.join(sorted(sources))}); see token_counts"
+        )
+
+    path = f"./data/{folder}/evaluation_{model_class}_{model_variant}_matrix"
+    write_csv_table(rows, columns, path + ".csv")
+    write_markdown_table(rows, columns, path + ".md")
+    print(f"Evaluated {len(rows)} runs into {path}.csv and {path}.md")
+
+
+def pipeline_process(
+    folder: str,
+    safe_types: list,
+    model_class: str,
+    model_variant: str,
+    attribution_sources: list,
+    num_sources: list,
+    test: bool,
+    num_examples: int = 16,
+    concurrency: int = DEFAULT_CONCURRENCY,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    timeout: float = DEFAULT_REQUEST_TIMEOUT,
+    resume: bool = False,
+    output_format: str = OutputFormat.JSONL.value,
+    token_budget: int = None,
+    select_examples: bool = False,
+    rerank: bool = False,
+) -> None:
+    """
+    Phases I-IV as a single streaming pipeline.
+
+    as soon as a sample's foveation finishes, its attributions start; as soon as an attribution finishes,
+    its rationalizations start. every split in safe_types and every (attribution_source, num_sources)
+    configuration shares one pool of `concurrency` workers in one process.
+    batch_size dictates the number of samples moving through each stage together; their prompts are
+    packed into one completion request and their foveations queried together.
+    every sample is checkpointed to the journal of each output as soon as its stage finishes;
+    use resume=True to skip samples already checkpointed and retry only failed ones.
+    token_budget, select_examples and rerank apply to rationalization prompts as in contextualized_reasoning_process,
+    except that snippets are reranked with corpus statistics from each sample's own snippets.
+    use test=True to run this step on only a single example.
+    outputs the same foveation, attribution, rationalization and evaluation files as running phases 1-4.
+    """
+    model = f"text-{model_variant}"
+    output = dict(folder=folder, model_class=model_class, model_variant=model_variant)
+
+    examples = {
+        safe: list(islice(read_base_examples(safe=safe), 1 if test else None))
+        for safe in safe_types
+    }
+    selections = {
+        safe: select_few_shot_examples(examples[safe], num_examples)
+        if select_examples
+        else None
+        for safe in safe_types
+    }
+
+    # one journal per output file, as in phases 1-3
+    foveations = {
+        safe: _open_journal(resume, phase=Phase.FOVEATION.value, safe=safe, **output)
+        for safe in safe_types
+    }
+    attributions = {
+        (safe, source): _open_journal(
+            resume,
+            phase=Phase.ATTRIBUTION.value,
+            safe=safe,
+            attribution_source=source,
+            **output,
+        )
+        for safe in safe_types
+        for source in attribution_sources
+    }
+    rationales = {
+        (safe, source, n): _open_journal(
+            resume,
+            phase=Phase.RATIONALIZATION.value,
+            safe=safe,
+            attribution_source=source,
+            num_sources=n,
+            **output,
+        )
+        for safe in safe_types
+        for source in attribution_sources
+        for n in num_sources
+    }
+
+    def complete(prompts: list, **kwargs) -> list:
+        # a batch of prompts goes out as one completion request
+        if len(prompts) == 1:
+            return [
+                gpt_completion_request(
+                    prompts[0], model=model, timeout=timeout, **kwargs
+                )
+            ]
+        return gpt_batch_completion_request(
+            prompts, model=model, timeout=timeout, **kwargs
+        )
+
+    # a stage only continues samples whose result is not an error; samples whose result was
+    # (re)recorded on this run are redone downstream even if journaled as done before
+    def foveate(safe: bool, batch: list) -> list:
+        journal = foveations[safe]
+        pending = [i for i in batch if not journal.done(i)]
+        if pending:
+            results = complete(
+                [
+                    context_prompt(
+                        prompt=examples[safe][i]["prompt"],
+                        advice=examples[safe][i]["advice"],
+                    )
+                    for i in pending
+                ],
+                max_tokens=256,
+                stop_tokens=["Q:", "A:"],
+                uncertainty=False,
+            )
+            for i, foveation in zip(pending, results):
+                if check_success(foveation):
+                    foveation[0]["completion"] = _clean_foveation(
+                        foveation[0]["completion"]
+                    )
+                journal.record(i, {"foveation": foveation})
+
+        succeeded = [i for i in batch if journal.done(i)]
+        if not succeeded:
+            return []
+        return [
+            partial(attribute, safe, succeeded, source, set(pending))
+            for source in attribution_sources
+        ]
+
+    def attribute(safe: bool, batch: list, source: str, refreshed: set) -> list:
+        journal = attributions[(safe, source)]
+        pending = [i for i in batch if i in refreshed or not journal.done(i)]
+        if pending:
+            query_batch, _ = _attribution_batch_query(source)
+            results = query_batch(
+                [foveations[safe].fields(i)["foveation"] for i in pending]
+            )
+            for i, attribution in zip(pending, results):
+                journal.record(i, {"attribution": attribution})
+
+        succeeded = [i for i in batch if journal.done(i)]
+        if not succeeded:
+            return []
+        return [
+            partial(rationalize, safe, succeeded, source, n, set(pending))
+            for n in num_sources
+        ]
+
+    def rationalize(
+        safe: bool, batch: list, source: str, n: int, refreshed: set
+    ) -> list:
+        journal = rationales[(safe, source, n)]
+        pending = [i for i in batch if i in refreshed or not journal.done(i)]
+        if not pending:
+            return []
+
+        fields, prompts = list(), list()
+        for i in pending:
+            sample = {
+                **examples[safe][i],
+                **foveations[safe].fields(i),
+                **attributions[(safe, source)].fields(i),
+            }
+            ranked = (
+                next(rerank_attributed_examples(lambda: [sample])) if rerank else sample
+            )
+            sample_fields, prompt = _rationalization_prompt(
+                ranked,
+                n,
+                num_examples,
+                token_budget,
+                selections[safe][i] if selections[safe] else None,
+            )
+            fields.append(sample_fields)
+            prompts.append(prompt)
+
+        explanations = complete(prompts, max_tokens=128, uncertainty=True)
+        for i, sample_fields, explanation in zip(pending, fields, explanations):
+            journal.record(i, {**sample_fields, "explanation": explanation})
+
+        return []
+
+    run_streaming(
+        [
+            partial(foveate, safe, batch)
+            for safe in safe_types
+            for batch in chunked(range(len(examples[safe])), batch_size)
+        ],
+        concurrency,
+    )
+
+    # every output is assembled from its journal on top of the outputs of the stages before it
+    foveated = lambda safe: foveations[safe].apply(examples[safe])
+    attributed = lambda safe, source: attributions[(safe, source)].apply(foveated(safe))
+
+    for safe in safe_types:
+        _save_examples(
+            foveated(safe),
+            output_format,
+            phase=Phase.FOVEATION.value,
+            safe=safe,
+            **output,
+        )
+
+    for safe, source in attributions:
+        _save_examples(
+            attributed(safe, source),
+            output_format,
+            phase=Phase.ATTRIBUTION.value,
+            safe=safe,
+            attribution_source=source,
+            **output,
+        )
+
+    for (safe, source, n), journal in rationales.items():
+        _save_examples(
+            journal.apply(attributed(safe, source)),
+            output_format,
+            phase=Phase.RATIONALIZATION.value,
+            safe=safe,
+            attribution_source=source,
+            num_sources=n,
+            **output,
+        )
+
+        # samples that failed at any stage have no rationale, so their configuration is evaluated once resumed
+        failed = sum(not journal.done(i) for i in range(len(examples[safe])))
+        if failed:
+            print(
+                f"Skipping evaluation of {safety_conditional(safe)} {source} snippet{n}: "
+                f"{failed} samples failed, rerun with --resume to retry them"
+            )
+            continue
+
+        try:
+            evaluation_process(
+                safe=safe,
+                attribution_source=source,
+                num_sources=n,
+                baseline=False,
+                **output,
+            )
+        except Exception as e:
+            print(f"ERROR: {e}")
+
+    for journal in [*foveations.values(), *attributions.values(), *rationales.values()]:
+        journal.close()
+
+
 if __name__ == "__main__":
     # argument parsing
     parser = argparse.ArgumentParser()
@@ -324,9 +1070,9 @@ if __name__ == "__main__":
         "-p",
         "--phase",
         type=int,
-        choices={0, 1, 2, 3, 4},
+        choices={0, 1, 2, 3, 4, 5},
         required=True,
-        help="{0|1|2|3|4}.. use '0' to run baseline, '1' to run foveation, '2' to run augmentation, '3' to run rationalization, '4' to run evaluation",
+        help="{0|1|2|3|4|5}.. use '0' to run baseline, '1' to run foveation, '2' to run augmentation, '3' to run rationalization, '4' to run evaluation, '5' to run phases 1-4 as one streaming pipeline",
     )
 
     parser.add_argument(
@@ -351,6 +1097,7 @@ if __name__ == "__main__":
         "-s",
         "--num_sources",
         type=int,
+        nargs="+",
         choices=range(1, 10),
         metavar="[1-10]",
         required=False,
@@ -361,6 +1108,7 @@ if __name__ == "__main__":
         "-a",
         "--attribution_source",
         type=str,
+        nargs="+",
         required=False,
         choices=get_enum_values(AttributionSource),
         help=INVALID_ATTRIBUTION_SOURCE_ERROR,
@@ -377,14 +1125,211 @@ if __name__ == "__main__":
         help="{0..16}.",
     )
 
+    parser.add_argument(
+        "-c",
+        "--concurrency",
+        type=int,
+        required=False,
+        default=DEFAULT_CONCURRENCY,
+        help="number of API requests in flight at once.",
+    )
+
+    parser.add_argument(
+        "-b",
+        "--batch_size",
+        type=int,
+        choices=range(1, MAX_BATCH_SIZE + 1),
+        metavar=f"[1-{MAX_BATCH_SIZE}]",
+        required=False,
+        default=DEFAULT_BATCH_SIZE,
+        help="number of prompts packed into a single completion request.",
+    )
+
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        required=False,
+        default=DEFAULT_REQUEST_TIMEOUT,
+        help="seconds to wait on a single completion request before giving up.",
+    )
+
+    parser.add_argument(
+        "--rpm",
+        type=int,
+        required=False,
+        default=GPT_REQUESTS_PER_MINUTE,
+        help="completion requests per minute allowed by the OpenAI quota.",
+    )
+
+    parser.add_argument(
+        "--tpm",
+        type=int,
+        required=False,
+        default=GPT_TOKENS_PER_MINUTE,
+        help="prompt plus completion tokens per minute allowed by the OpenAI quota.",
+    )
+
+    parser.add_argument(
+        "--cache",
+        type=str,
+        nargs="?",
+        const=COMPLETION_CACHE_PATH,
+        required=False,
+        help=f"cache completions in this SQLite file (default: {COMPLETION_CACHE_PATH}).",
+    )
+
+    parser.add_argument(
+        "--cache_max_age",
+        type=float,
+        required=False,
+        help="seconds after which cached completions expire.",
+    )
+
+    parser.add_argument(
+        "--cache_max_entries",
+        type=int,
+        required=False,
+        help="maximum number of cached completions; the oldest are evicted.",
+    )
+
+    parser.add_argument(
+        "--retrieval_cache",
+        type=str,
+        nargs="?",
+        const=RETRIEVAL_CACHE_PATH,
+        required=False,
+        help=f"cache SERP and Wikipedia responses in this SQLite file (default: {RETRIEVAL_CACHE_PATH}).",
+    )
+
+    parser.add_argument(
+        "--retrieval_max_age",
+        type=float,
+        required=False,
+        default=RETRIEVAL_CACHE_MAX_AGE,
+        help="seconds after which cached SERP and Wikipedia responses expire.",
+    )
+
+    parser.add_argument(
+        "--local_index",
+        type=str,
+        required=False,
+        default=LOCAL_INDEX_PATH,
+        help=f"index directory searched by the local_index attribution source (default: {LOCAL_INDEX_PATH}).",
+    )
+
+    parser.add_argument("--replay", action="store_true")
+    parser.set_defaults(replay=False)
+
+    parser.add_argument(
+        "--format",
+        type=str,
+        choices=get_enum_values(OutputFormat),
+        required=False,
+        default=OutputFormat.JSONL.value,
+        help="{jsonl|json}.. store phase outputs as JSON lines or as a single indented JSON list.",
+    )
+
+    parser.add_argument(
+        "--token_budget",
+        type=int,
+        required=False,
+        help="maximum GPT-2 tokens per rationalization prompt; few-shot examples are dropped, then snippets shortened, to fit.",
+    )
+
+    parser.add_argument("--select_examples", action="store_true")
+    parser.set_defaults(select_examples=False)
+
+    parser.add_argument("--rerank", action="store_true")
+    parser.set_defaults(rerank=False)
+
+    parser.add_argument("--resume", action="store_true")
+    parser.set_defaults(resume=False)
+
     parser.add_argument("--test", action="store_true")
     parser.set_defaults(test=False)
 
     parser.add_argument("--baseline", action="store_true")
     parser.set_defaults(baseline=False)
 
+    parser.add_argument("--matrix", action="store_true")
+    parser.set_defaults(matrix=False)
+
+    parser.add_argument(
+        "--workers",
+        type=int,
+        required=False,
+        help="number of worker processes evaluating runs with --matrix (default: one per CPU).",
+    )
+
+    parser.add_argument(
+        "--metrics_port",
+        type=int,
+        required=False,
+        help="serve live request metrics on this port (Prometheus text at /metrics, JSON elsewhere).",
+    )
+
     args = parser.parse_args()
     model_class, model_variant = _parse_model(args.model)
+    GPT_RATE_LIMITER.configure(args.rpm, args.tpm)
+    if args.cache or args.replay:
+        configure_cache(
+            args.cache or COMPLETION_CACHE_PATH,
+            replay=args.replay,
+            max_age=args.cache_max_age,
+            max_entries=args.cache_max_entries,
+        )
+    if args.retrieval_cache or args.replay:
+        configure_retrieval_cache(
+            args.retrieval_cache or RETRIEVAL_CACHE_PATH,
+            replay=args.replay,
+            max_age=args.retrieval_max_age,
+        )
+    if AttributionSource.LOCAL_INDEX.value in (args.attribution_source or []):
+        from models.local_index import configure_local_index
+
+        configure_local_index(args.local_index)
+    if args.select_examples and args.num_examples >= few_shot_pool_size():
+        print(
+            f"WARNING: --select_examples with -e {args.num_examples} gives every sample all {few_shot_pool_size()} "
+            "few-shot examples, only reordered, and a prompt prefix of its own; use a smaller -e to select among them"
+        )
+    if args.concurrency > HTTP_POOL_SIZE:
+        configure_http(pool_size=args.concurrency)
+
+    # label request metrics with the phase and summarize them when the run exits
+    phase = list(Phase)[args.phase].value
+    METRICS.set_phase(phase)
+    if args.metrics_port:
+        serve_metrics(args.metrics_port)
+    # one summary per distinct run, named like its outputs (i.e., by split, snippets and sources)
+    run = dict(
+        folder=args.folder,
+        model=args.model,
+        phase=phase,
+        type=args.type,
+        num_sources=args.num_sources,
+        attribution_source=args.attribution_source,
+        baseline=args.baseline,
+        matrix=args.matrix,
+    )
+    metrics_path = (
+        f"./data/{args.folder}/metrics_{model_class}_{model_variant}_{phase}_{args.type}"
+        f"{'_snippet' + '-'.join(map(str, args.num_sources)) if args.num_sources else ''}"
+        f"{'_' + '-'.join(args.attribution_source) if args.attribution_source else ''}"
+        f"{'_baseline' if args.baseline else ''}{'_matrix' if args.matrix else ''}.json"
+    )
+
+    def write_metrics():
+        METRICS.write_summary(metrics_path, **run)
+        print(f"Metrics: {metrics_path}")
+
+    def close_caches():
+        # closing evicts expired entries and entries beyond --cache_max_entries
+        configure_cache(None)
+        configure_retrieval_cache(None)
+
+    atexit.register(write_metrics)
+    atexit.register(close_caches)
     print("Arguments parsed correctly.")
 
     # ----- STAGE 0 -----
@@ -397,6 +1342,12 @@ if __name__ == "__main__":
                 model_variant=model_variant,
                 num_examples=args.num_examples,
                 test=args.test,
+                concurrency=args.concurrency,
+                resume=args.resume,
+                output_format=args.format,
+                batch_size=args.batch_size,
+                timeout=args.timeout,
+                select_examples=args.select_examples,
             )
         if args.type in ["safe", "all"]:
             baseline_process(
@@ -406,6 +1357,12 @@ if __name__ == "__main__":
                 model_variant=model_variant,
                 num_examples=args.num_examples,
                 test=args.test,
+                concurrency=args.concurrency,
+                resume=args.resume,
+                output_format=args.format,
+                batch_size=args.batch_size,
+                timeout=args.timeout,
+                select_examples=args.select_examples,
             )
 
     # ----- STAGE 1 -----
@@ -417,6 +1374,11 @@ if __name__ == "__main__":
                 model_class=model_class,
                 model_variant=model_variant,
                 test=args.test,
+                concurrency=args.concurrency,
+                resume=args.resume,
+                output_format=args.format,
+                batch_size=args.batch_size,
+                timeout=args.timeout,
             )
         if args.type in ["safe", "all"]:
             foveation_process(
@@ -425,30 +1387,42 @@ if __name__ == "__main__":
                 model_class=model_class,
                 model_variant=model_variant,
                 test=args.test,
+                concurrency=args.concurrency,
+                resume=args.resume,
+                output_format=args.format,
+                batch_size=args.batch_size,
+                timeout=args.timeout,
             )
 
     # ----- STAGE 2 -----
     elif args.phase == 2:
         assert args.attribution_source, INVALID_ATTRIBUTION_SOURCE_ERROR
 
-        if args.type in ["unsafe", "all"]:
-            attribution_process(
-                folder=args.folder,
-                safe=False,
-                model_class=model_class,
-                model_variant=model_variant,
-                attribution_source=args.attribution_source,
-                test=args.test,
-            )
-        if args.type in ["safe", "all"]:
-            attribution_process(
-                folder=args.folder,
-                safe=True,
-                model_class=model_class,
-                model_variant=model_variant,
-                attribution_source=args.attribution_source,
-                test=args.test,
-            )
+        for attribution_source in args.attribution_source:
+            if args.type in ["unsafe", "all"]:
+                attribution_process(
+                    folder=args.folder,
+                    safe=False,
+                    model_class=model_class,
+                    model_variant=model_variant,
+                    attribution_source=attribution_source,
+                    test=args.test,
+                    concurrency=args.concurrency,
+                    resume=args.resume,
+                    output_format=args.format,
+                )
+            if args.type in ["safe", "all"]:
+                attribution_process(
+                    folder=args.folder,
+                    safe=True,
+                    model_class=model_class,
+                    model_variant=model_variant,
+                    attribution_source=attribution_source,
+                    test=args.test,
+                    concurrency=args.concurrency,
+                    resume=args.resume,
+                    output_format=args.format,
+                )
 
     # ----- STAGE 3 -----
     elif args.phase == 3:
@@ -465,8 +1439,16 @@ if __name__ == "__main__":
                 model_variant=model_variant,
                 num_sources=args.num_sources,
                 num_examples=args.num_examples,
-                attribution_source=args.attribution_source,
+                attribution_sources=args.attribution_source,
                 test=args.test,
+                concurrency=args.concurrency,
+                resume=args.resume,
+                output_format=args.format,
+                batch_size=args.batch_size,
+                timeout=args.timeout,
+                token_budget=args.token_budget,
+                select_examples=args.select_examples,
+                rerank=args.rerank,
             )
         if args.type in ["safe", "all"]:
             contextualized_reasoning_process(
@@ -476,32 +1458,77 @@ if __name__ == "__main__":
                 model_variant=model_variant,
                 num_sources=args.num_sources,
                 num_examples=args.num_examples,
-                attribution_source=args.attribution_source,
+                attribution_sources=args.attribution_source,
                 test=args.test,
+                concurrency=args.concurrency,
+                resume=args.resume,
+                output_format=args.format,
+                batch_size=args.batch_size,
+                timeout=args.timeout,
+                token_budget=args.token_budget,
+                select_examples=args.select_examples,
+                rerank=args.rerank,
             )
 
     # ----- STAGE 4 -----
+    elif args.phase == 4 and args.matrix:
+        evaluation_matrix_process(
+            folder=args.folder,
+            safe_types=[False, True] if args.type == "all" else [args.type == "safe"],
+            model_class=model_class,
+            model_variant=model_variant,
+            workers=args.workers,
+        )
+
     elif args.phase == 4:
-        if args.type in ["unsafe", "all"]:
-            evaluation_process(
-                folder=args.folder,
-                safe=False,
-                model_class=model_class,
-                model_variant=model_variant,
-                num_sources=args.num_sources,
-                attribution_source=args.attribution_source,
-                baseline=args.baseline,
-            )
-        if args.type in ["safe", "all"]:
-            evaluation_process(
-                folder=args.folder,
-                safe=True,
-                model_class=model_class,
-                model_variant=model_variant,
-                num_sources=args.num_sources,
-                attribution_source=args.attribution_source,
-                baseline=args.baseline,
-            )
+        for attribution_source in args.attribution_source or [None]:
+            for num_sources in args.num_sources or [None]:
+                if args.type in ["unsafe", "all"]:
+                    evaluation_process(
+                        folder=args.folder,
+                        safe=False,
+                        model_class=model_class,
+                        model_variant=model_variant,
+                        num_sources=num_sources,
+                        attribution_source=attribution_source,
+                        baseline=args.baseline,
+                    )
+                if args.type in ["safe", "all"]:
+                    evaluation_process(
+                        folder=args.folder,
+                        safe=True,
+                        model_class=model_class,
+                        model_variant=model_variant,
+                        num_sources=num_sources,
+                        attribution_source=attribution_source,
+                        baseline=args.baseline,
+                    )
+
+    # ----- FULL PIPELINE -----
+    elif args.phase == 5:
+        assert (
+            args.num_sources
+        ), f"Must set -n --num_sources flag for rationalization step"
+        assert args.attribution_source, INVALID_ATTRIBUTION_SOURCE_ERROR
+
+        pipeline_process(
+            folder=args.folder,
+            safe_types=[False, True] if args.type == "all" else [args.type == "safe"],
+            model_class=model_class,
+            model_variant=model_variant,
+            attribution_sources=args.attribution_source,
+            num_sources=args.num_sources,
+            num_examples=args.num_examples,
+            test=args.test,
+            concurrency=args.concurrency,
+            batch_size=args.batch_size,
+            timeout=args.timeout,
+            resume=args.resume,
+            output_format=args.format,
+            token_budget=args.token_budget,
+            select_examples=args.select_examples,
+            rerank=args.rerank,
+        )
 
     # ----- INVALID INPUT -----
     else:
@@ -1,25 +1,32 @@
-from transformers import GPT2TokenizerFast
 import numpy as np
-from util.constants import TOLERANCE
+from util.constants import (
+    CONFIDENCE_LEVEL,
+    NUM_BOOTSTRAP_SAMPLES,
+    NUM_PERMUTATIONS,
+    RESAMPLE_CHUNK_SIZE,
+    RESAMPLE_SEED,
+    TOLERANCE,
+)
+from util.tokenizer import count_tokens
 
-tokenizer = GPT2TokenizerFast.from_pretrained("gpt2")
 
-
-def _remove_zeros(values: list) -> list:
+def _remove_zeros(values: np.array) -> np.array:
     """
-    removes zeros from list
+    removes zeros from array
     """
-    return [i for i in values if i != 0]
+    return values[values != 0]
 
 
-def _binary_entropy(p: np.float) -> np.float:
+def _binary_entropy(p: np.array) -> np.array:
     """
-    computes binary cross entropy
+    computes binary cross entropy elementwise
     """
-    if np.abs(p < TOLERANCE) or np.abs(p - 1) < TOLERANCE:
-        return 0
+    p = np.asarray(p, dtype=float)
+    degenerate = (p < TOLERANCE) | (np.abs(p - 1) < TOLERANCE)
 
-    return -p * np.log2(p) - (1 - p) * np.log2(1 - p)
+    # evaluate degenerate probabilities at 0.5 to avoid log(0), then zero them out
+    q = np.where(degenerate, 0.5, p)
+    return np.where(degenerate, 0, -q * np.log2(q) - (1 - q) * np.log2(1 - q))
 
 
 def _hinge_loss(predictions: np.array, labels: np.array) -> np.array:
@@ -41,51 +48,212 @@ def _hinge_loss(predictions: np.array, labels: np.array) -> np.array:
 #     }
 
 
-def evaluate(examples: list, safe: bool):
+def extract_columns(examples, safe: bool) -> dict:
     """
-    computes accuracy, entropy, and log probability for a particular domain
+    pulls the fields evaluation needs out of the examples into numpy arrays in a single pass
+        correct: 1 for correct classifications, -1 otherwise
+        probability: probability of the correct first token
+        log_probability: log probability of the completion
+        num_tokens: number of tokens in the completion
+        counted: whether num_tokens was recorded with the completion (False where it was retokenized)
+    token counts recorded by the API (num_tokens) are used as is; other completions are tokenized with GPT-2.
     """
     key = " Yes" if safe else " No"
     stipped_key = key.strip()
 
+    completions, log_probabilities, key_log_probabilities = list(), list(), list()
+    num_tokens = list()
+    for example in examples:
+        explanation = example["explanation"][0]
+        completions.append(explanation["completion"])
+        log_probabilities.append(explanation["log_probability"])
+        num_tokens.append(explanation.get("num_tokens", np.nan))
+        key_log_probabilities.append(
+            explanation["first_token_distribution"].get(key, 0)
+        )
+
     # identify correct classifications
-    correct_classifications = np.array(
-        [
-            1
-            if example["explanation"][0]["completion"].split(".")[0] == stipped_key
-            else -1
-            for example in examples
-        ]
+    correct = np.array(
+        [completion.split(".")[0] == stipped_key for completion in completions],
+        dtype=bool,
     )
 
-    # identify log probabilities for correct classifications
-    probabilities = [
-        np.exp(example["explanation"][0]["first_token_distribution"].get(key, 0))
-        for example in examples
-    ]
+    # only tokenize completions without a recorded token count
+    num_tokens = np.array(num_tokens, dtype=float)
+    counted = ~np.isnan(num_tokens)
+    uncounted = np.flatnonzero(~counted)
+    if len(uncounted):
+        num_tokens[uncounted] = count_tokens([completions[i] for i in uncounted])
+
+    return {
+        "correct": np.where(correct, 1, -1),
+        "probability": np.exp(np.array(key_log_probabilities, dtype=float)),
+        "log_probability": np.array(log_probabilities, dtype=float),
+        "num_tokens": num_tokens,
+        "counted": counted,
+    }
+
+
+def token_count_source(columns: dict) -> str:
+    """
+    returns the token counts perplexities divide by: "api" (recorded with the completions), "gpt2" (retokenized),
+    or "mixed" when a run has both, whose perplexities then rest on two different denominators
+    """
+    if columns["counted"].all():
+        return "api"
+    if not columns["counted"].any():
+        return "gpt2"
+    return "mixed"
+
+
+def sample_metrics(columns: dict) -> dict:
+    """
+    computes the per-sample contribution to each metric from extracted columns.
+    accuracy and entropies average over all samples; logprobs average over their nonzero entries.
+    """
+    correct_classifications = columns["correct"]
 
     # compute entropy values for classification
-    entropies = np.array([_binary_entropy(p) for p in probabilities])
+    entropies = _binary_entropy(columns["probability"])
     correct_entropies = _hinge_loss(entropies, correct_classifications)
     incorrect_entropies = _hinge_loss(entropies, -1 * correct_classifications)
 
     # compute log probability values for classification
-    log_probabilities = [
-        np.exp(
-            -example["explanation"][0]["log_probability"]
-            / len(tokenizer(example["explanation"][0]["completion"])["input_ids"])
-        )
-        for example in examples
-    ]
+    log_probabilities = np.exp(-columns["log_probability"] / columns["num_tokens"])
 
     return {
-        "accuracy": np.count_nonzero(correct_entropies) / len(entropies),
-        "entropy_correct": np.mean(correct_entropies),
-        "entropy_incorrect": np.mean(incorrect_entropies),
-        "logprobs_correct": np.mean(
-            _remove_zeros(_hinge_loss(log_probabilities, correct_classifications))
-        ),
-        "logprobs_incorrect": np.mean(
-            _remove_zeros(_hinge_loss(log_probabilities, -1 * correct_classifications))
+        "accuracy": (correct_entropies != 0).astype(float),
+        "entropy_correct": correct_entropies,
+        "entropy_incorrect": incorrect_entropies,
+        "logprobs_correct": _hinge_loss(log_probabilities, correct_classifications),
+        "logprobs_incorrect": _hinge_loss(
+            log_probabilities, -1 * correct_classifications
         ),
     }
+
+
+def evaluate_columns(columns: dict) -> dict:
+    """
+    computes accuracy, entropy, and log probability from extracted columns
+    """
+    samples = sample_metrics(columns)
+
+    return {
+        "accuracy": np.count_nonzero(samples["accuracy"]) / len(samples["accuracy"]),
+        "entropy_correct": np.mean(samples["entropy_correct"]),
+        "entropy_incorrect": np.mean(samples["entropy_incorrect"]),
+        "logprobs_correct": np.mean(_remove_zeros(samples["logprobs_correct"])),
+        "logprobs_incorrect": np.mean(_remove_zeros(samples["logprobs_incorrect"])),
+        "token_counts": token_count_source(columns),
+    }
+
+
+def _aggregate(samples: dict) -> dict:
+    """
+    aggregates per-sample metrics along the last axis, so each row of a resampled matrix is aggregated independently
+    (nan where a row has no nonzero logprobs)
+    """
+    aggregates = dict()
+    for metric, values in samples.items():
+        if metric.startswith("logprobs"):
+            with np.errstate(divide="ignore", invalid="ignore"):
+                aggregates[metric] = values.sum(axis=-1) / np.count_nonzero(
+                    values, axis=-1
+                )
+        else:
+            aggregates[metric] = values.mean(axis=-1)
+
+    return aggregates
+
+
+def _chunks(total: int):
+    """
+    yields the sizes of the resample chunks making up total resamples
+    """
+    for start in range(0, total, RESAMPLE_CHUNK_SIZE):
+        yield min(RESAMPLE_CHUNK_SIZE, total - start)
+
+
+def bootstrap_intervals(
+    columns: dict,
+    num_samples: int = NUM_BOOTSTRAP_SAMPLES,
+    confidence: float = CONFIDENCE_LEVEL,
+    seed: int = RESAMPLE_SEED,
+) -> dict:
+    """
+    computes percentile bootstrap confidence intervals from extracted columns.
+    every resample is a row of a [num_samples, n] index matrix drawn with replacement.
+    returns {metric: [low, high]}
+    """
+    samples = sample_metrics(columns)
+    n = len(columns["correct"])
+    if n == 0:
+        return dict()
+
+    rng = np.random.default_rng(seed)
+    estimates = {metric: list() for metric in samples}
+    for size in _chunks(num_samples):
+        indices = rng.integers(0, n, size=(size, n))
+        resampled = _aggregate(
+            {metric: values[indices] for metric, values in samples.items()}
+        )
+        for metric, values in resampled.items():
+            estimates[metric].append(values)
+
+    tail = (1 - confidence) / 2 * 100
+    return {
+        metric: np.nanpercentile(np.concatenate(values), [tail, 100 - tail]).tolist()
+        for metric, values in estimates.items()
+    }
+
+
+def paired_permutation_test(
+    columns: dict,
+    other_columns: dict,
+    num_permutations: int = NUM_PERMUTATIONS,
+    seed: int = RESAMPLE_SEED,
+) -> dict:
+    """
+    two-sided paired permutation test between two runs over the same samples, in the same order.
+    every permutation swaps the results of the two runs on a random subset of samples.
+    returns {metric: {"difference": metric of columns - metric of other_columns, "p_value": ...}}
+    """
+    if len(columns["correct"]) != len(other_columns["correct"]):
+        raise ValueError("paired runs must cover the same samples")
+
+    samples, other_samples = sample_metrics(columns), sample_metrics(other_columns)
+    aggregates, other_aggregates = _aggregate(samples), _aggregate(other_samples)
+    observed = {
+        metric: aggregates[metric] - other_aggregates[metric] for metric in samples
+    }
+
+    rng = np.random.default_rng(seed)
+    extreme = {metric: 0 for metric in samples}
+    for size in _chunks(num_permutations):
+        swap = rng.random((size, len(columns["correct"]))) < 0.5
+        for metric in samples:
+            a = np.where(swap, other_samples[metric], samples[metric])
+            b = np.where(swap, samples[metric], other_samples[metric])
+            differences = (
+                _aggregate({metric: a})[metric] - _aggregate({metric: b})[metric]
+            )
+            extreme[metric] += np.count_nonzero(
+                np.abs(differences) >= np.abs(observed[metric]) - TOLERANCE
+            )
+
+    return {
+        metric: {
+            "difference": float(observed[metric]),
+            "p_value": (extreme[metric] + 1) / (num_permutations + 1)
+            if np.isfinite(observed[metric])
+            else np.nan,
+        }
+        for metric in samples
+    }
+
+
+def evaluate(examples, safe: bool):
+    """
+    computes accuracy, entropy, and log probability for a particular domain
+    """
+    return evaluate_columns(extract_columns(examples, safe))
@@ -1,30 +1,109 @@
 import os
 from dotenv import load_dotenv
-import requests
 from util.constants import (
     CREDIBLE_DOMAINS,
     SERP_ENDPOINT,
     SERP_PARAMS,
+    SERP_REQUESTS_PER_MINUTE,
 )
-from util.attribution import format_query
+from util.attribution import format_query, normalize_query
+from util.cache import CacheMiss, ResponseCache, request_key
+from util.http import http_get
+from util.rate_limit import RateLimiter, call_with_backoff
 
 # Handle environment
 load_dotenv()
 
+# shared across every thread issuing SERP API requests
+SERP_RATE_LIMITER = RateLimiter("serp", requests_per_minute=SERP_REQUESTS_PER_MINUTE)
+
+# on-disk SERP/Wikipedia cache, see configure_retrieval_cache
+RETRIEVAL_CACHE = None
+
+
+def configure_retrieval_cache(path: str, replay: bool = False, max_age: float = None):
+    """
+    enables the on-disk retrieval cache at path with a time-to-live of max_age seconds.
+    use path=None to disable it; use replay=True to answer only from the cache without network.
+    """
+    global RETRIEVAL_CACHE
+    if RETRIEVAL_CACHE is not None:
+        RETRIEVAL_CACHE.close()
+
+    RETRIEVAL_CACHE = (
+        ResponseCache(path, max_age=max_age, replay=replay, name="retrieval")
+        if path
+        else None
+    )
+
+
+def retrieval_cache_stats() -> dict:
+    """
+    returns hit/miss statistics of the retrieval cache, or None if it is disabled
+    """
+    return RETRIEVAL_CACHE.stats() if RETRIEVAL_CACHE is not None else None
+
+
+def cached_retrieval(request: dict, query):
+    """
+    returns the cached response for request, calling query() on a miss when the cache is configured
+    """
+    if RETRIEVAL_CACHE is None:
+        return query()
+
+    return RETRIEVAL_CACHE.fetch(request, query)
+
+
+def cached_retrievals(requests: list, query) -> list:
+    """
+    returns the responses for a list of requests, from the cache where possible.
+    the uncached requests are answered by a single query(uncached requests) call, returning their responses in order.
+    responses that are exceptions are returned as is and not cached; in replay mode uncached requests get a CacheMiss.
+    """
+    keys = [request_key(request) for request in requests]
+    responses = [
+        RETRIEVAL_CACHE.get(key) if RETRIEVAL_CACHE is not None else None
+        for key in keys
+    ]
+    pending = [i for i, response in enumerate(responses) if response is None]
+    if not pending:
+        return responses
+
+    if RETRIEVAL_CACHE is not None and RETRIEVAL_CACHE.replay:
+        for i in pending:
+            responses[i] = CacheMiss(f"no cached response in replay mode for {keys[i]}")
+        return responses
+
+    for i, response in zip(pending, query([requests[i] for i in pending])):
+        responses[i] = response
+        if RETRIEVAL_CACHE is not None and not isinstance(response, Exception):
+            RETRIEVAL_CACHE.set(keys[i], response)
+
+    return responses
+
+
+def _serp_get(query: str):
+    """
+    issues a single SERP API request over a pooled connection, raising on non-200 responses
+    """
+    return http_get(
+        os.getenv("SERP_ENDPOINT", SERP_ENDPOINT),
+        params={**SERP_PARAMS, "q": query, "api_key": os.getenv("SERP_API_KEY")},
+        backend=SERP_RATE_LIMITER.name,
+    ).json()
+
 
 def serp_search(query: str):
     """
     queries Google for front page results using SERP API
+    retries rate limited and failed requests with backoff
+    responses are cached by the normalized query
     """
-    response = requests.get(
-        SERP_ENDPOINT,
-        params={**SERP_PARAMS, "q": query, "api_key": os.getenv("SERP_API_KEY")},
+    return cached_retrieval(
+        {**SERP_PARAMS, "q": normalize_query(query)},
+        lambda: call_with_backoff(lambda: _serp_get(query), SERP_RATE_LIMITER),
     )
 
-    # return text if html successful
-    assert response.status_code == 200, f"Response status {response.status_code}"
-    return response.json()
-
 
 def query_google_snippet(foveation: str, credible: bool = False):
     """
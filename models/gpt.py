@@ -1,14 +1,49 @@
 # Imports
 import os
-import openai
-import numpy as np
+from collections import deque
 from dotenv import load_dotenv
 
-from util.constants import DEFAULT_GPT_MODEL
+from util.concurrency import bounded_map, chunked
+from util.constants import (
+    DEFAULT_GPT_MODEL,
+    DEFAULT_REQUEST_TIMEOUT,
+    GPT_REQUESTS_PER_MINUTE,
+    GPT_TOKENS_PER_MINUTE,
+)
+from util.cache import CacheMiss, ResponseCache, request_key
+from util.prefixes import compact_prompt
+from util.metrics import METRICS
+from util.rate_limit import RateLimiter, call_with_backoff, estimate_tokens
 
 # Handle environment
 load_dotenv()
-openai.api_key = os.getenv("OPENAI_API_KEY")
+
+# openai is imported on first request, see _openai
+OPENAI = None
+
+# shared across every thread issuing completion requests
+GPT_RATE_LIMITER = RateLimiter(
+    "gpt",
+    requests_per_minute=GPT_REQUESTS_PER_MINUTE,
+    tokens_per_minute=GPT_TOKENS_PER_MINUTE,
+)
+
+# on-disk completion cache, see configure_cache
+GPT_CACHE = None
+
+
+def _openai():
+    """
+    imports and configures the openai client on first use, keeping it off the startup path
+    """
+    global OPENAI
+    if OPENAI is None:
+        import openai
+
+        openai.api_key = os.getenv("OPENAI_API_KEY")
+        OPENAI = openai
+
+    return OPENAI
 
 
 def check_success(response: any) -> bool:
@@ -18,6 +53,123 @@ def check_success(response: any) -> bool:
     return type(response) == list and len(response) > 0
 
 
+def _request_error(
+    e: Exception,
+    prompt: str,
+    max_tokens: int,
+    temperature: float,
+    top_p: float,
+    model: str,
+    stop_tokens: list,
+    uncertainty: bool,
+) -> dict:
+    """
+    returns the error record stored in place of a failed completion.
+    few-shot prefixes of the prompt are stored by reference (see util.prefixes).
+    """
+    return {
+        "error": e.__str__(),
+        "prompt": compact_prompt(prompt),
+        "max_tokens": max_tokens,
+        "temperature": temperature,
+        "top_p": top_p,
+        "model": model,
+        "stop_tokens": stop_tokens,
+        "uncertainty": uncertainty,
+    }
+
+
+def _parse_choice(item: dict, max_tokens: int, uncertainty: bool):
+    """
+    parses a single completion choice.
+    returns the stripped completion, or the completion with uncertainty calculations when uncertainty=True.
+    num_tokens records how many tokens log_probability sums over, so evaluation need not re-tokenize.
+    """
+    if not uncertainty:
+        return item["text"].strip(" .")
+
+    import numpy as np
+
+    stop_index = max_tokens
+
+    # stop computation at the stop token if it exists
+    try:
+        stop_index = item["logprobs"]["tokens"].index("<|endoftext|>")
+    except:
+        pass
+
+    return {
+        "completion": item["text"].strip(" ."),
+        "log_probability": np.sum(item["logprobs"]["token_logprobs"][:stop_index]),
+        "first_token_distribution": dict(item["logprobs"]["top_logprobs"][0]),
+        "num_tokens": len(item["logprobs"]["tokens"][:stop_index]),
+    }
+
+
+def _completion_params(
+    prompt,
+    max_tokens: int,
+    temperature: float,
+    top_p: float,
+    model: str,
+    stop_tokens: list,
+    frequency_penalty: float,
+    presence_penalty: float,
+) -> dict:
+    """
+    returns the Completion.create parameters for a prompt (or list of prompts)
+    """
+    return {
+        "model": model,
+        "prompt": prompt,
+        "max_tokens": max_tokens,
+        "temperature": temperature,
+        "top_p": top_p,
+        "stop": stop_tokens,
+        "logprobs": 5,
+        "frequency_penalty": frequency_penalty,
+        "presence_penalty": presence_penalty,
+    }
+
+
+def _create_completion(params: dict, timeout: float) -> list:
+    """
+    issues a rate limited completion request and returns its choices
+    records the latency of every attempt and the tokens the API reports spending
+    """
+    prompts = (
+        params["prompt"] if isinstance(params["prompt"], list) else [params["prompt"]]
+    )
+
+    def create():
+        with METRICS.track(GPT_RATE_LIMITER.name):
+            return _openai().Completion.create(**params, request_timeout=timeout)
+
+    response = call_with_backoff(
+        create,
+        GPT_RATE_LIMITER,
+        tokens=sum(
+            estimate_tokens(prompt) + params["max_tokens"] for prompt in prompts
+        ),
+    )
+
+    usage = response.get("usage", dict())
+    for name in ["prompt_tokens", "completion_tokens"]:
+        METRICS.increment(GPT_RATE_LIMITER.name, name, usage.get(name, 0))
+
+    return response["choices"]
+
+
+def _cached_choices(params: dict, timeout: float) -> list:
+    """
+    returns the choices for a single prompt request, from the cache when configured
+    """
+    if GPT_CACHE is None:
+        return _create_completion(params, timeout)
+
+    return GPT_CACHE.fetch(params, lambda: _create_completion(params, timeout))
+
+
 def gpt_completion_request(
     prompt: str,
     max_tokens: int = 256,
@@ -28,63 +180,197 @@ def gpt_completion_request(
     uncertainty: bool = False,
     frequency_penalty: float = 0,
     presence_penalty: float = 0,
+    timeout: float = DEFAULT_REQUEST_TIMEOUT,
     **kwargs,
 ) -> str:
     """
     given a prompt, query gpt-3 as completion task to generate a response and return list of responses.
     max_tokens denotes max response length.
     temperature denotes added randomness in abstractive generation.
+    timeout denotes the number of seconds to wait on the API before giving up.
     """
+    params = _completion_params(
+        prompt,
+        max_tokens,
+        temperature,
+        top_p,
+        model,
+        stop_tokens,
+        frequency_penalty,
+        presence_penalty,
+    )
+
     try:
-        response = openai.Completion.create(
-            model=model,
-            prompt=prompt,
-            max_tokens=max_tokens,
-            temperature=temperature,
-            top_p=top_p,
-            stop=stop_tokens,
-            logprobs=5,
-            frequency_penalty=frequency_penalty,
-            presence_penalty=presence_penalty,
-        )
+        choices = _cached_choices(params, timeout)
 
     except Exception as e:
         print(f"ERROR: {e}")
 
-        return {
-            "error": e.__str__(),
-            "prompt": prompt,
-            "max_tokens": max_tokens,
-            "temperature": temperature,
-            "top_p": top_p,
-            "model": model,
-            "stop_tokens": stop_tokens,
-            "uncertainty": uncertainty,
-        }
+        return _request_error(
+            e, prompt, max_tokens, temperature, top_p, model, stop_tokens, uncertainty
+        )
 
     # only return completion in base case
     if not uncertainty:
-        return response["choices"][0]["text"].strip(" .")
+        return _parse_choice(choices[0], max_tokens, uncertainty)
 
     # return completion and uncertainty calculations
-    result = list()
-    for item in response["choices"]:
-        stop_index = max_tokens
-
-        # stop computation at the stop token if it exists
-        try:
-            stop_index = item["logprobs"]["tokens"].index("<|endoftext|>")
-        except:
-            pass
-
-        result.append(
-            {
-                "completion": item["text"].strip(" ."),
-                "log_probability": np.sum(
-                    item["logprobs"]["token_logprobs"][:stop_index]
-                ),
-                "first_token_distribution": dict(item["logprobs"]["top_logprobs"][0]),
-            }
+    return [_parse_choice(item, max_tokens, uncertainty) for item in choices]
+
+
+def gpt_batch_completion_request(
+    prompts: list,
+    max_tokens: int = 256,
+    temperature: float = 0,
+    top_p: float = 1,
+    model: str = DEFAULT_GPT_MODEL,
+    stop_tokens: list = None,
+    uncertainty: bool = False,
+    frequency_penalty: float = 0,
+    presence_penalty: float = 0,
+    timeout: float = DEFAULT_REQUEST_TIMEOUT,
+    **kwargs,
+) -> list:
+    """
+    given a list of prompts, query gpt-3 with all prompts in a single completion request.
+    returns one response per prompt, in prompt order, shaped like the output of gpt_completion_request.
+    cached prompts are answered from the cache and left out of the request.
+    """
+    params = _completion_params(
+        prompts,
+        max_tokens,
+        temperature,
+        top_p,
+        model,
+        stop_tokens,
+        frequency_penalty,
+        presence_penalty,
+    )
+
+    def error(e: Exception, prompt: str) -> dict:
+        return _request_error(
+            e, prompt, max_tokens, temperature, top_p, model, stop_tokens, uncertainty
         )
 
-    return result
+    def result(item: dict):
+        choice = _parse_choice(item, max_tokens, uncertainty)
+        return choice if not uncertainty else [choice]
+
+    # answer what we can from the cache, keeping track of the prompts still to query
+    results = [None] * len(prompts)
+    pending = list()
+    for i, prompt in enumerate(prompts):
+        if GPT_CACHE is None:
+            pending.append(i)
+            continue
+
+        key = request_key({**params, "prompt": prompt})
+        cached = GPT_CACHE.get(key)
+
+        if cached is not None:
+            results[i] = result(cached[0])
+        elif GPT_CACHE.replay:
+            results[i] = error(
+                CacheMiss(f"no cached response in replay mode for {key}"), prompt
+            )
+        else:
+            pending.append(i)
+
+    if not pending:
+        return results
+
+    try:
+        choices = _create_completion(
+            {**params, "prompt": [prompts[i] for i in pending]}, timeout
+        )
+
+    except Exception as e:
+        print(f"ERROR: {e}")
+
+        for i in pending:
+            results[i] = error(e, prompts[i])
+        return results
+
+    # choices are not guaranteed to come back in prompt order, so map them by index
+    for item in choices:
+        i = pending[item["index"]]
+        results[i] = result(item)
+
+        if GPT_CACHE is not None:
+            GPT_CACHE.set(request_key({**params, "prompt": prompts[i]}), [item])
+
+    # prompts the API returned no choice for are recorded as errors, to be retried on --resume
+    for position, i in enumerate(pending):
+        if results[i] is None:
+            results[i] = error(
+                ValueError(f"no choice returned for prompt {position} of the batch"),
+                prompts[i],
+            )
+
+    return results
+
+
+def configure_cache(
+    path: str, replay: bool = False, max_age: float = None, max_entries: int = None
+):
+    """
+    enables the on-disk completion cache at path; use path=None to disable it.
+    use replay=True to answer only from the cache without issuing any API requests.
+    """
+    global GPT_CACHE
+    if GPT_CACHE is not None:
+        GPT_CACHE.close()
+
+    GPT_CACHE = (
+        ResponseCache(
+            path,
+            max_age=max_age,
+            max_entries=max_entries,
+            replay=replay,
+            name=GPT_RATE_LIMITER.name,
+        )
+        if path
+        else None
+    )
+
+
+def gpt_completion_requests(
+    prompts: list, concurrency: int = 1, batch_size: int = 1, **kwargs
+):
+    """
+    given an iterable of prompts, query gpt-3 with up to `concurrency` requests in flight.
+    batch_size > 1 packs that many prompts into each request.
+    yields responses in the same order as the prompts.
+    remaining keyword arguments are forwarded to gpt_(batch_)completion_request.
+    """
+    if batch_size <= 1:
+        yield from bounded_map(
+            lambda prompt: gpt_completion_request(prompt, **kwargs),
+            prompts,
+            concurrency,
+        )
+        return
+
+    for results in bounded_map(
+        lambda batch: gpt_batch_completion_request(batch, **kwargs),
+        chunked(prompts, batch_size),
+        concurrency,
+    ):
+        yield from results
+
+
+def gpt_completion_stream(requests, **kwargs):
+    """
+    given an iterable of (key, prompt) pairs, lazily yields (key, response) pairs in order.
+    only the requests in flight are held in memory.
+    keyword arguments are forwarded to gpt_completion_requests.
+    """
+    in_flight = deque()
+
+    def prompts():
+        for key, prompt in requests:
+            in_flight.append(key)
+            yield prompt
+
+    for response in gpt_completion_requests(prompts(), **kwargs):
+        yield in_flight.popleft(), response
@@ -0,0 +1,371 @@
+import argparse
+import gzip
+import json
+import os
+import threading
+import zlib
+import xml.etree.ElementTree as ElementTree
+import numpy as np
+
+from util.concurrency import chunked
+from util.constants import (
+    BM25_B,
+    BM25_K1,
+    LOCAL_INDEX_BUILD_CHUNK_SIZE,
+    LOCAL_INDEX_FEATURES,
+    LOCAL_INDEX_MAX_DOCUMENT_FREQUENCY,
+    LOCAL_INDEX_MIN_STOPWORD_DOCUMENTS,
+    LOCAL_INDEX_PATH,
+    MAX_RESULTS,
+)
+from util.metrics import METRICS
+from util.retrieval import tokenize
+
+# index directory searched by query_local_index, see configure_local_index
+LOCAL_INDEX_DIRECTORY = LOCAL_INDEX_PATH
+
+# loaded on first query and shared across every thread issuing attribution queries
+LOCAL_INDEX = None
+LOCAL_INDEX_LOCK = threading.Lock()
+
+
+def _term_ids(text: str, num_features: int) -> np.array:
+    """
+    returns the hashed feature index of every word of a text (crc32, as in util.retrieval)
+    """
+    return (
+        np.array(
+            [zlib.crc32(token.encode("utf-8")) for token in tokenize(text)],
+            dtype=np.int64,
+        )
+        % num_features
+    )
+
+
+def _corpus_record(record: dict) -> dict:
+    """
+    maps a JSON lines corpus record onto a document
+    """
+    return {
+        "source": record.get("source", record.get("url", "")),
+        "title": record.get("title", ""),
+        "content": record.get(
+            "content", record.get("abstract", record.get("text", ""))
+        ),
+    }
+
+
+def _read_abstracts_dump(file) -> dict:
+    """
+    lazily parses the <doc> elements of a Wikipedia abstracts dump (i.e., enwiki-latest-abstract.xml)
+    """
+    events = ElementTree.iterparse(file, events=("start", "end"))
+    _, root = next(events)
+
+    for event, element in events:
+        if event == "end" and element.tag == "doc":
+            yield {
+                "source": element.findtext("url", ""),
+                "title": element.findtext("title", "").removeprefix("Wikipedia: "),
+                "content": element.findtext("abstract", ""),
+            }
+            # drop parsed documents so memory stays flat over the whole dump
+            root.clear()
+
+
+def read_corpus(path: str):
+    """
+    lazily reads {"source", "title", "content"} documents from a Wikipedia abstracts dump (.xml)
+    or from JSON lines with "content" (or "abstract"/"text") and optional "source" (or "url") and "title" keys.
+    either may be gzipped (.gz); documents without content are skipped.
+    """
+    with gzip.open(path, "rb") if path.endswith(".gz") else open(path, "rb") as file:
+        if ".xml" in os.path.basename(path):
+            documents = _read_abstracts_dump(file)
+        else:
+            documents = (
+                _corpus_record(json.loads(line)) for line in file if line.strip()
+            )
+
+        for document in documents:
+            if document["content"].strip():
+                yield document
+
+
+def _chunk_postings(texts: list, first_document: int, num_features: int) -> tuple:
+    """
+    returns the (terms, documents, term frequencies) postings and the lengths of a chunk of documents
+    """
+    terms = [_term_ids(text, num_features) for text in texts]
+    lengths = np.array([len(words) for words in terms], dtype=np.int64)
+    owners = np.repeat(
+        np.arange(first_document, first_document + len(texts), dtype=np.int64),
+        lengths,
+    )
+
+    keys, frequencies = np.unique(
+        owners * num_features + np.concatenate(terms), return_counts=True
+    )
+    return (
+        (keys % num_features).astype(np.uint32),
+        (keys // num_features).astype(np.uint32),
+        frequencies.astype(np.float32),
+        lengths,
+    )
+
+
+def _memory_map(path: str, name: str) -> np.array:
+    """
+    memory maps an array of the index, as a plain array to skip np.memmap overhead on every slice
+    """
+    return np.asarray(np.load(os.path.join(path, name), mmap_mode="r"))
+
+
+class LocalIndex:
+    """
+    on-disk BM25 inverted index over a local corpus (e.g., a Wikipedia abstracts dump).
+    words are hashed into num_features terms; every posting stores its precomputed BM25 weight,
+    so a query only sums the postings of its terms. the index is a directory of '.npy' arrays and
+    the documents as JSON lines, memory mapped on load, so opening even a large index is instant.
+    """
+
+    def __init__(self, path: str):
+        with open(os.path.join(path, "index.json"), "r") as file:
+            meta = json.load(file)
+
+        self.num_features = meta["num_features"]
+        self.num_documents = meta["num_documents"]
+
+        # postings[indptr[t] : indptr[t + 1]] are the documents containing term t, weights their BM25 weights
+        self.indptr = _memory_map(path, "indptr.npy")
+        self.postings = _memory_map(path, "postings.npy")
+        self.weights = _memory_map(path, "weights.npy")
+
+        # documents.jsonl[offsets[d] : offsets[d + 1]] is the JSON line of document d
+        self.offsets = _memory_map(path, "offsets.npy")
+        self.documents = np.memmap(
+            os.path.join(path, "documents.jsonl"), dtype=np.uint8, mode="r"
+        )
+
+    @classmethod
+    def load(cls, path: str):
+        if not os.path.exists(os.path.join(path, "index.json")):
+            raise FileNotFoundError(
+                f"no local index at {path}; build one with `python -m models.local_index CORPUS -o {path}`"
+            )
+        return cls(path)
+
+    @classmethod
+    def build(
+        cls,
+        documents,
+        path: str,
+        num_features: int = LOCAL_INDEX_FEATURES,
+        k1: float = BM25_K1,
+        b: float = BM25_B,
+        max_document_frequency: float = LOCAL_INDEX_MAX_DOCUMENT_FREQUENCY,
+    ):
+        """
+        indexes an iterable of documents (see read_corpus) into the directory at path.
+        documents are streamed to disk in chunks; only the postings are held in memory.
+        terms in more than max_document_frequency of the documents are left out, like stopwords,
+        once the corpus has at least LOCAL_INDEX_MIN_STOPWORD_DOCUMENTS documents (in smaller corpora
+        document frequencies say little about which words are stopwords).
+        raises ValueError if no term is left to index.
+        """
+        os.makedirs(path, exist_ok=True)
+
+        terms, owners, frequencies, lengths = list(), list(), list(), list()
+        offsets = [0]
+        with open(os.path.join(path, "documents.jsonl"), "wb") as store:
+            for chunk in chunked(documents, LOCAL_INDEX_BUILD_CHUNK_SIZE):
+                postings = _chunk_postings(
+                    [
+                        f"{document['title']}. {document['content']}"
+                        for document in chunk
+                    ],
+                    len(offsets) - 1,
+                    num_features,
+                )
+                for values, chunk_values in zip(
+                    (terms, owners, frequencies, lengths), postings
+                ):
+                    values.append(chunk_values)
+
+                for document in chunk:
+                    line = (json.dumps(document) + "\n").encode("utf-8")
+                    store.write(line)
+                    offsets.append(offsets[-1] + len(line))
+
+        num_documents = len(offsets) - 1
+        if num_documents == 0:
+            raise ValueError("cannot build a local index from an empty corpus")
+
+        terms, owners = np.concatenate(terms), np.concatenate(owners)
+        frequencies, lengths = np.concatenate(frequencies), np.concatenate(lengths)
+
+        document_frequencies = np.bincount(terms, minlength=num_features)
+        idf = np.log(
+            1
+            + (num_documents - document_frequencies + 0.5)
+            / (document_frequencies + 0.5)
+        )
+        average_length = lengths.mean() or 1
+        weights = (
+            idf[terms]
+            * frequencies
+            * (k1 + 1)
+            / (frequencies + k1 * (1 - b + b * lengths[owners] / average_length))
+        )
+
+        if num_documents >= LOCAL_INDEX_MIN_STOPWORD_DOCUMENTS:
+            keep = document_frequencies[terms] <= max_document_frequency * num_documents
+            terms, owners, weights = terms[keep], owners[keep], weights[keep]
+
+        if len(terms) == 0:
+            raise ValueError(
+                f"no terms left to index in {num_documents} documents; raise max_document_frequency"
+            )
+
+        # postings arrive ordered by document, so a stable sort by term keeps each term's documents ascending
+        order = np.argsort(terms, kind="stable")
+        indptr = np.concatenate(
+            [[0], np.cumsum(np.bincount(terms, minlength=num_features))]
+        )
+
+        np.save(os.path.join(path, "indptr.npy"), indptr.astype(np.int64))
+        np.save(os.path.join(path, "postings.npy"), owners[order])
+        np.save(os.path.join(path, "weights.npy"), weights[order].astype(np.float32))
+        np.save(os.path.join(path, "offsets.npy"), np.array(offsets, dtype=np.int64))
+        with open(os.path.join(path, "index.json"), "w") as file:
+            json.dump(
+                {
+                    "num_features": num_features,
+                    "num_documents": num_documents,
+                    "k1": k1,
+                    "b": b,
+                    "max_document_frequency": max_document_frequency,
+                },
+                file,
+                indent=2,
+            )
+
+        return cls(path)
+
+    def search(self, query: str, k: int = MAX_RESULTS) -> list:
+        """
+        returns the (document, score) pairs of the k documents scoring highest against query, best first
+        (ties go to the earlier document; documents sharing no term with query are never returned)
+        """
+        terms = np.unique(_term_ids(query, self.num_features))
+        starts, ends = self.indptr[terms], self.indptr[terms + 1]
+        if not np.any(ends > starts):
+            return list()
+
+        postings = np.concatenate(
+            [self.postings[start:end] for start, end in zip(starts, ends)]
+        )
+        weights = np.concatenate(
+            [self.weights[start:end] for start, end in zip(starts, ends)]
+        )
+
+        # every term's postings are already sorted, so a stable (merge) sort only merges the runs
+        order = np.argsort(postings, kind="stable")
+        postings, weights = postings[order], weights[order]
+        firsts = np.flatnonzero(np.diff(postings, prepend=-1))
+        documents = postings[firsts]
+        scores = np.add.reduceat(weights, firsts)
+
+        # keep every document tied with the k-th best score, so ties go to the earlier document
+        best = np.arange(len(scores))
+        if len(scores) > k:
+            best = np.flatnonzero(scores >= -np.partition(-scores, k - 1)[k - 1])
+        best = best[np.lexsort((best, -scores[best]))][:k]
+
+        return list(zip(documents[best].tolist(), scores[best].tolist()))
+
+    def document(self, index: int) -> dict:
+        """
+        returns a document by its index
+        """
+        return json.loads(
+            bytes(self.documents[self.offsets[index] : self.offsets[index + 1]])
+        )
+
+
+def configure_local_index(path: str):
+    """
+    sets the directory of the index searched by query_local_index (loaded on the next query)
+    """
+    global LOCAL_INDEX_DIRECTORY, LOCAL_INDEX
+    with LOCAL_INDEX_LOCK:
+        LOCAL_INDEX_DIRECTORY = path
+        LOCAL_INDEX = None
+
+
+def _local_index() -> LocalIndex:
+    """
+    returns the configured local index, loading it on first use
+    """
+    global LOCAL_INDEX
+    with LOCAL_INDEX_LOCK:
+        if LOCAL_INDEX is None:
+            LOCAL_INDEX = LocalIndex.load(LOCAL_INDEX_DIRECTORY)
+        return LOCAL_INDEX
+
+
+def query_local_index(foveation: str):
+    """
+    searches the local knowledge base with the input foveation as query, without any network requests
+    returns a list of the most relevant documents and associated sources
+    """
+    try:
+        index = _local_index()
+
+        # return the best matching documents like the other attribution sources
+        with METRICS.track("local_index"):
+            return [
+                {
+                    "source": document["source"],
+                    "content": document["content"],
+                }
+                for document in (index.document(i) for i, _ in index.search(foveation))
+            ]
+
+    except Exception as e:
+        # handle potential errors
+        print(f"ERROR {e} for foveation: {foveation}")
+        return {
+            "error": e.__str__(),
+            "local_query": foveation,
+        }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="build the local knowledge base index searched by the local_index attribution source"
+    )
+    parser.add_argument(
+        "corpus",
+        help="Wikipedia abstracts dump (.xml) or JSON lines of documents, optionally gzipped",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        default=LOCAL_INDEX_PATH,
+        help=f"index directory (default: {LOCAL_INDEX_PATH}).",
+    )
+    parser.add_argument(
+        "--max_document_frequency",
+        type=float,
+        default=LOCAL_INDEX_MAX_DOCUMENT_FREQUENCY,
+        help="leave out terms in more than this fraction of documents.",
+    )
+    args = parser.parse_args()
+
+    index = LocalIndex.build(
+        read_corpus(args.corpus),
+        args.output,
+        max_document_frequency=args.max_document_frequency,
+    )
+    print(f"Indexed {index.num_documents} documents into {args.output}")
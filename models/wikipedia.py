@@ -1,8 +1,23 @@
-import requests
-from models.google import serp_search, parse_serp_wikipages
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from models.google import cached_retrievals, serp_search, parse_serp_wikipages
 from util.attribution import format_query
+from util.concurrency import chunked
+from util.http import http_get
+
+from util.constants import (
+    WIKIPEDIA_BATCH_PARAMS,
+    WIKIPEDIA_DOMAIN,
+    WIKIPEDIA_ENDPOINT,
+    WIKIPEDIA_HEADERS,
+    WIKIPEDIA_MAX_TITLES,
+    WIKIPEDIA_RETRIEVAL_WORKERS,
+)
 
-from util.constants import WIKIPEDIA_DOMAIN, WIKIPEDIA_ENDPOINT, WIKIPEDIA_HEADERS
+# runs the Google searches and abstract requests of query_wikipedia_batch; tasks never wait on each other,
+# so the pool is shared by every caller (requests per host are capped by util.http)
+RETRIEVAL_WORKERS = ThreadPoolExecutor(max_workers=WIKIPEDIA_RETRIEVAL_WORKERS)
 
 
 def _clean_title(title: str) -> str:
@@ -12,30 +27,78 @@ def _clean_title(title: str) -> str:
     return title.split("-")[0].strip().split("–")[0].strip()
 
 
+def _attributions(sources: list, abstracts: dict) -> list:
+    """
+    pairs every wikipedia source with its abstract, skipping sources without one
+    """
+    results = list()
+    for source in sources:
+        abstract = abstracts[_clean_title(source["title"])]
+        if isinstance(abstract, str):
+            results.append(
+                {
+                    "source": source["source"],
+                    "content": abstract,
+                }
+            )
+    return results
+
+
 def query_wikipedia(foveation: str):
     """
     invokes google search with the input foveation as query using only Wikipedia articles
     returns a list of wikipedia articles and associated abstracts
     """
+    return query_wikipedia_batch([foveation])[0]
+
+
+def query_wikipedia_batch(foveations: list) -> list:
+    """
+    query_wikipedia for several foveations at once, fanned out over the shared retrieval workers.
+    all Google searches are issued together; abstracts are fetched WIKIPEDIA_MAX_TITLES titles per request
+    as soon as that many titles are known, overlapping the searches still in flight.
+    returns the attributions (or error) of every foveation in order
+    """
     # find wikipedia sources with relevant matches
-    sources = get_wikipedia_sources(foveation)
-
-    # for each page, extract the abstract and return attributions
-    if isinstance(sources, list):
-        results = list()
-        for source in sources:
-            abstract = get_wikipedia_abstract(_clean_title(source["title"]))
-            if isinstance(abstract, str):
-                results.append(
-                    {
-                        "source": source["source"],
-                        "content": abstract,
-                    }
+    searches = {
+        RETRIEVAL_WORKERS.submit(get_wikipedia_sources, foveation): i
+        for i, foveation in enumerate(foveations)
+    }
+
+    sources = [None] * len(foveations)
+    fetches, titles, seen = list(), list(), set()
+    for search in as_completed(searches):
+        results = search.result()
+        sources[searches[search]] = results
+
+        if isinstance(results, list):
+            for source in results:
+                title = _clean_title(source["title"])
+                if title not in seen:
+                    seen.add(title)
+                    titles.append(title)
+
+        # extract the abstracts of a full request's worth of pages while other searches finish
+        while len(titles) >= WIKIPEDIA_MAX_TITLES:
+            fetches.append(
+                RETRIEVAL_WORKERS.submit(
+                    get_wikipedia_abstracts, titles[:WIKIPEDIA_MAX_TITLES]
                 )
-        return results
+            )
+            titles = titles[WIKIPEDIA_MAX_TITLES:]
+
+    if titles:
+        fetches.append(RETRIEVAL_WORKERS.submit(get_wikipedia_abstracts, titles))
 
-    # return raised error if not list
-    return sources
+    abstracts = dict()
+    for fetch in fetches:
+        abstracts.update(fetch.result())
+
+    # return attributions, or the raised error if not list
+    return [
+        _attributions(results, abstracts) if isinstance(results, list) else results
+        for results in sources
+    ]
 
 
 def get_wikipedia_sources(foveation: str) -> list:
@@ -59,27 +122,114 @@ def get_wikipedia_sources(foveation: str) -> list:
         }
 
 
-def get_wikipedia_abstract(title: str) -> str:
+def _abstract_request(title: str) -> dict:
     """
-    returns abstract of a given wikipedia page title
+    returns the request identifying the abstract of a page title in the retrieval cache
+    (including the batch parameters, so abstracts cached before redirects were followed are not served)
     """
-    try:
-        # query wikipedia endpoint for response
-        response = requests.get(
-            WIKIPEDIA_ENDPOINT, params={**WIKIPEDIA_HEADERS, "titles": title}
+    return {**WIKIPEDIA_HEADERS, **WIKIPEDIA_BATCH_PARAMS, "titles": title}
+
+
+def _resolve_title(title: str, aliases: dict) -> str:
+    """
+    follows the normalizations and redirects of a requested title to the title of its page
+    """
+    seen = set()
+    while title in aliases and title not in seen:
+        seen.add(title)
+        title = aliases[title]
+    return title
+
+
+def _request_wikipedia_abstracts(titles: list) -> list:
+    """
+    queries the wikipedia endpoint for the abstracts of up to WIKIPEDIA_MAX_TITLES page titles in one request
+    (plus continuations), following normalized and redirected titles back to the requested ones.
+    returns the abstract of every title in order, or a LookupError for titles without one.
+    """
+    params = {
+        **WIKIPEDIA_HEADERS,
+        **WIKIPEDIA_BATCH_PARAMS,
+        "titles": "|".join(titles),
+    }
+    aliases, extracts = dict(), dict()
+
+    while True:
+        response = http_get(
+            os.getenv("WIKIPEDIA_ENDPOINT", WIKIPEDIA_ENDPOINT),
+            params=params,
+            backend="wikipedia",
         ).json()
 
         # output possible warnings
         if "warnings" in response:
             print(response["warnings"])
 
-        # return first abstract if exists
-        return next(iter(response["query"]["pages"].values()))["extract"]
+        query = response.get("query", dict())
+        for alias in query.get("normalized", list()) + query.get("redirects", list()):
+            aliases[alias["from"]] = alias["to"]
+        for page in query.get("pages", dict()).values():
+            if "extract" in page:
+                extracts[page["title"]] = page["extract"]
 
-    except Exception as e:
-        # handle potential errors
-        print(f"ERROR {e} for query: {title}")
-        return {
-            "error": e.__str__(),
-            "wikipedia_query": title,
-        }
+        # extracts beyond the per request limit come back in continuations
+        if "continue" not in response:
+            break
+        params = {**params, **response["continue"]}
+
+    return [
+        extracts.get(
+            _resolve_title(title, aliases), LookupError(f"no abstract for {title}")
+        )
+        for title in titles
+    ]
+
+
+def _fetch_wikipedia_abstracts(requests: list) -> list:
+    """
+    fetches the abstracts of uncached abstract requests WIKIPEDIA_MAX_TITLES titles at a time
+    (a failed request fails only the titles it contained).
+    requests are issued one after another, since this runs on the retrieval workers itself.
+    """
+    abstracts = list()
+    for batch in chunked(
+        [request["titles"] for request in requests], WIKIPEDIA_MAX_TITLES
+    ):
+        try:
+            abstracts.extend(_request_wikipedia_abstracts(batch))
+        except Exception as e:
+            abstracts.extend([e] * len(batch))
+    return abstracts
+
+
+def get_wikipedia_abstracts(titles: list) -> dict:
+    """
+    returns the abstract of every given wikipedia page title, fetching the uncached ones in batched requests
+    (titles without an abstract map to an error record)
+    """
+    titles = list(dict.fromkeys(titles))
+
+    # query wikipedia endpoint for the abstracts (cached by title)
+    abstracts = cached_retrievals(
+        [_abstract_request(title) for title in titles], _fetch_wikipedia_abstracts
+    )
+
+    results = dict()
+    for title, abstract in zip(titles, abstracts):
+        if isinstance(abstract, Exception):
+            # handle potential errors
+            print(f"ERROR {abstract} for query: {title}")
+            abstract = {
+                "error": abstract.__str__(),
+                "wikipedia_query": title,
+            }
+        results[title] = abstract
+
+    return results
+
+
+def get_wikipedia_abstract(title: str) -> str:
+    """
+    returns abstract of a given wikipedia page title
+    """
+    return get_wikipedia_abstracts([title])[title]
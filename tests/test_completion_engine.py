@@ -0,0 +1,89 @@
+import time
+from functools import partial
+
+import pytest
+
+import models.gpt as gpt
+from bench.servers import serve
+from util.concurrency import bounded_map
+from util.metrics import METRICS
+from util.rate_limit import call_with_backoff
+
+WORDS = [
+    "alpha",
+    "bravo",
+    "charlie",
+    "delta",
+    "echo",
+    "foxtrot",
+    "golf",
+    "hotel",
+    "india",
+    "juliett",
+    "kilo",
+    "lima",
+    "mike",
+    "november",
+    "oscar",
+    "papa",
+]
+
+
+@pytest.fixture(scope="module")
+def server():
+    """
+    points the completion client at a local stand-in completion server (see bench/servers.py)
+    """
+    server = serve(latency_ms=20, latency_sigma=0.5)
+    openai = gpt._openai()
+    previous = openai.api_base, openai.api_key
+    openai.api_base = f"http://127.0.0.1:{server.server_address[1]}/v1"
+    openai.api_key = "test"
+
+    yield server
+
+    openai.api_base, openai.api_key = previous
+    server.shutdown()
+
+
+def _complete(prompt: str, **kwargs):
+    return gpt.gpt_completion_request(prompt, uncertainty=False, **kwargs)
+
+
+def test_responses_keep_prompt_order(server):
+    # lognormal latencies make responses finish out of order
+    prompts = [f"Q: is it safe to touch the {word}" for word in WORDS]
+
+    responses = list(bounded_map(_complete, prompts, 8))
+
+    assert [response.split()[-1] for response in responses] == WORDS
+
+
+def test_slow_request_times_out(server, monkeypatch):
+    monkeypatch.setattr(server.backends["openai"], "latency_ms", 2000)
+    monkeypatch.setattr(server.backends["openai"], "latency_sigma", 0)
+    monkeypatch.setattr(
+        gpt, "call_with_backoff", partial(call_with_backoff, max_retries=0)
+    )
+
+    start = time.monotonic()
+    response = _complete("Q: is it safe to wait", timeout=0.3)
+
+    assert "error" in response
+    assert time.monotonic() - start < 1.5
+
+
+def test_concurrency_caps_requests_in_flight(server, monkeypatch):
+    monkeypatch.setattr(server.backends["openai"], "latency_ms", 100)
+    monkeypatch.setattr(server.backends["openai"], "latency_sigma", 0)
+    monkeypatch.setattr(METRICS, "phase", "test_concurrency")
+    prompts = [f"Q: is it safe to juggle the {word}" for word in WORDS]
+
+    start = time.monotonic()
+    responses = list(bounded_map(_complete, prompts, 4))
+    elapsed = time.monotonic() - start
+
+    requests = METRICS.summary()["test_concurrency"]["gpt"]
+    assert len(responses) == requests["latency"]["count"] == len(WORDS)
+    assert requests["max_in_flight"] == 4
+    assert elapsed >= len(WORDS) / 4 * 0.1
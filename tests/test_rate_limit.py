@@ -0,0 +1,25 @@
+import time
+
+from util.rate_limit import RateLimiter
+
+
+def test_throttle_pauses_callers_for_the_delay():
+    limiter = RateLimiter("test", requests_per_minute=600)
+    limiter.acquire()
+
+    # time passing before the rate limit response must not shorten the pause
+    time.sleep(1.5)
+    limiter.throttle(1.0)
+
+    start = time.monotonic()
+    limiter.acquire()
+    assert time.monotonic() - start >= 1.0
+
+
+def test_acquire_does_not_wait_with_budget_left():
+    limiter = RateLimiter("test", requests_per_minute=600)
+
+    start = time.monotonic()
+    for _ in range(10):
+        limiter.acquire()
+    assert time.monotonic() - start < 0.1
@@ -0,0 +1,47 @@
+from util.util import _snippet_query, rerank_attributed_examples
+
+SCENARIO = {"prompt": "If you are hungry", "advice": "eat a wild mushroom"}
+SNIPPETS = [
+    {
+        "source": "https://mushrooms.org/foraging",
+        "content": "a guide to foraging wild mushrooms for hungry hikers",
+    },
+    {
+        "source": "https://firesafety.org/extinguishers",
+        "content": "how to use a fire extinguisher safely",
+    },
+]
+
+
+def _sources(example: dict) -> list:
+    reranked = next(rerank_attributed_examples(lambda: [example]))
+    return [snippet["source"] for snippet in reranked["attribution"]]
+
+
+def test_string_foveation_is_the_query():
+    example = {**SCENARIO, "foveation": "using a fire extinguisher"}
+
+    assert _snippet_query(example) == "using a fire extinguisher"
+    assert _sources({**example, "attribution": SNIPPETS}) == [
+        "https://firesafety.org/extinguishers",
+        "https://mushrooms.org/foraging",
+    ]
+
+
+def test_legacy_completion_list_foveation_is_the_query():
+    # defensive: current runs store foveations as strings, older outputs as completion lists
+    example = {**SCENARIO, "foveation": [{"completion": "using a fire extinguisher"}]}
+
+    assert _snippet_query(example) == "using a fire extinguisher"
+
+
+def test_failed_foveation_falls_back_to_the_scenario():
+    example = {**SCENARIO, "foveation": {"error": "timed out", "prompt": "..."}}
+
+    assert (
+        _snippet_query(example) == "If you are hungry, should you eat a wild mushroom?"
+    )
+    assert _sources({**example, "attribution": SNIPPETS}) == [
+        "https://mushrooms.org/foraging",
+        "https://firesafety.org/extinguishers",
+    ]
@@ -3,3 +3,11 @@ def format_query(foveation: str) -> str:
     formats the query correctly for google search
     """
     return foveation.replace('"', "").replace("'", "")
+
+
+def normalize_query(query: str) -> str:
+    """
+    normalizes a formatted query for cache lookups
+    (i.e., ignores casing and repeated whitespace)
+    """
+    return " ".join(format_query(query).lower().split())
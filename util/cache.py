@@ -0,0 +1,160 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from util.constants import CACHE_EVICTION_INTERVAL
+from util.metrics import METRICS
+
+
+class CacheMiss(Exception):
+    """
+    raised on a cache miss while replaying, since no network request may be issued
+    """
+
+
+def request_key(request: dict) -> str:
+    """
+    returns a content address (sha256) for a JSON-serializable request
+    """
+    return hashlib.sha256(
+        json.dumps(request, sort_keys=True, default=str).encode("utf-8")
+    ).hexdigest()
+
+
+class ResponseCache:
+    """
+    on-disk SQLite cache of JSON responses keyed by a request hash.
+    max_age (seconds) expires old entries; max_entries evicts the least recently written entries.
+    both are enforced when the cache is opened, every eviction_interval writes, and on close.
+    use replay=True to serve only from the cache and raise CacheMiss instead of querying.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        max_age: float = None,
+        max_entries: int = None,
+        replay: bool = False,
+        name: str = "cache",
+        eviction_interval: int = CACHE_EVICTION_INTERVAL,
+    ):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self.max_age = max_age
+        self.max_entries = max_entries
+        self.replay = replay
+        self.name = name
+        self.eviction_interval = eviction_interval
+        self.writes = 0
+        self.hits = 0
+        self.misses = 0
+
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, response TEXT, created REAL)"
+        )
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS responses_created ON responses (created)"
+        )
+        self.connection.commit()
+        self.evict()
+
+    def get(self, key: str):
+        """
+        returns the cached response for key, or None if absent or expired
+        """
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT response, created FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+
+            if row is None or (
+                self.max_age is not None and time.time() - row[1] > self.max_age
+            ):
+                self.misses += 1
+                METRICS.increment(self.name, "cache_misses")
+                return None
+
+            self.hits += 1
+            METRICS.increment(self.name, "cache_hits")
+            return json.loads(row[0])
+
+    def set(self, key: str, response: any):
+        """
+        stores the response for key; no-op in replay mode
+        """
+        if self.replay:
+            return
+
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?)",
+                (key, json.dumps(response), time.time()),
+            )
+            self.connection.commit()
+            self.writes += 1
+            due = self.writes % self.eviction_interval == 0
+
+        if due:
+            self.evict()
+
+    def fetch(self, request: dict, query):
+        """
+        returns the cached response for request, calling query() and caching its result on a miss
+        """
+        key = request_key(request)
+        response = self.get(key)
+        if response is not None:
+            return response
+
+        if self.replay:
+            raise CacheMiss(f"no cached response in replay mode for {key}")
+
+        response = query()
+        self.set(key, response)
+        return response
+
+    def evict(self) -> int:
+        """
+        removes expired entries and entries beyond max_entries (oldest first)
+        returns the number of entries removed
+        """
+        if self.replay:
+            return 0
+
+        with self.lock:
+            removed = 0
+            if self.max_age is not None:
+                removed += self.connection.execute(
+                    "DELETE FROM responses WHERE created < ?",
+                    (time.time() - self.max_age,),
+                ).rowcount
+
+            if self.max_entries is not None:
+                removed += self.connection.execute(
+                    "DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY created DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,),
+                ).rowcount
+
+            self.connection.commit()
+            return removed
+
+    def stats(self) -> dict:
+        """
+        returns hit/miss counters and the number of stored entries
+        """
+        with self.lock:
+            entries = self.connection.execute(
+                "SELECT COUNT(*) FROM responses"
+            ).fetchone()[0]
+
+        return {"hits": self.hits, "misses": self.misses, "entries": entries}
+
+    def close(self):
+        self.evict()
+        with self.lock:
+            self.connection.close()
@@ -0,0 +1,66 @@
+import heapq
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from itertools import islice
+from typing import Callable, Iterable, Iterator
+
+
+def bounded_map(fn: Callable, items: Iterable, concurrency: int = 1) -> Iterator:
+    """
+    applies fn to every item with at most `concurrency` calls in flight.
+    lazily yields results in the same order as the input items.
+    """
+    if concurrency <= 1:
+        for item in items:
+            yield fn(item)
+        return
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        # keep a window of submitted calls so workers stay busy while we wait
+        # on the oldest result, without consuming the whole input up front
+        pending = deque()
+        for item in items:
+            pending.append(executor.submit(fn, item))
+            if len(pending) >= 2 * concurrency:
+                yield pending.popleft().result()
+
+        while pending:
+            yield pending.popleft().result()
+
+
+def chunked(items: Iterable, size: int) -> Iterator[list]:
+    """
+    lazily splits items into lists of at most `size` elements
+    """
+    iterator = iter(items)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def run_streaming(tasks: list, concurrency: int = 1) -> None:
+    """
+    runs callables on a bounded thread pool, where each callable returns a list of follow-up callables.
+    follow-ups are scheduled ahead of root tasks that have not started yet (depth first),
+    so every item streams through all stages instead of one stage finishing at a time.
+    """
+    ready = [(0, i, task) for i, task in enumerate(tasks)]
+    heapq.heapify(ready)
+    scheduled = len(ready)
+
+    with ThreadPoolExecutor(max_workers=max(concurrency, 1)) as executor:
+        running = dict()
+        while ready or running:
+            while ready and len(running) < max(concurrency, 1):
+                priority, _, task = heapq.heappop(ready)
+                running[executor.submit(task)] = priority
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                # deeper stages get a smaller (more urgent) priority
+                priority = running.pop(future) - 1
+                for follow_up in future.result() or []:
+                    heapq.heappush(ready, (priority, scheduled, follow_up))
+                    scheduled += 1
@@ -16,6 +16,7 @@ class Phase(Enum):
     ATTRIBUTION = "attribution"
     RATIONALIZATION = "rationalization"
     EVALUATION = "evaluation"
+    PIPELINE = "pipeline"
 
 
 class Model(Enum):
@@ -34,11 +35,17 @@ class AttributionSource(Enum):
     GOOGLE_VANILLA = "google_vanilla"
     GOOGLE_CREDIBLE = "google_credible"
     WIKIPEDIA = "wikipedia"
+    LOCAL_INDEX = "local_index"
 
 
 INVALID_ATTRIBUTION_SOURCE_ERROR = f"must set -a --attribution_source flag to one of {get_enum_values(AttributionSource)}"
 
 
+class OutputFormat(Enum):
+    JSONL = "jsonl"
+    JSON = "json"
+
+
 class Domain(Enum):
     NATURE = "nature"
     HOUSEHOLD = "household"
@@ -56,6 +63,8 @@ CREDIBLE_DOMAINS = "site:.gov OR site:.org OR site:.edu"
 WIKIPEDIA_DOMAIN = "site:wikipedia.org"
 
 GOOGLE_ENDPOINT = "https://google.com/search"
+# endpoints can be overridden by environment variables (or .env entries) of the same name,
+# e.g. to point at bench/servers.py; they are read when each request is issued
 SERP_ENDPOINT = "https://serpapi.com/search"
 SERP_PARAMS = {
     "engine": "google",
@@ -72,6 +81,17 @@ WIKIPEDIA_HEADERS = {
     "exintro": True,
     "explaintext": True,
 }
+# added to batched abstract requests: follow redirects, and return an extract for every title
+WIKIPEDIA_BATCH_PARAMS = {
+    "redirects": True,
+    "exlimit": "max",
+}
+# most intro extracts the API returns per request
+WIKIPEDIA_MAX_TITLES = 20
+# foveations searched at once whose Wikipedia abstracts are fetched together (each has up to MAX_RESULTS titles)
+WIKIPEDIA_FOVEATION_BATCH_SIZE = 4
+# threads running Google searches and abstract requests for query_wikipedia_batch
+WIKIPEDIA_RETRIEVAL_WORKERS = 32
 
 # ... relating to webscraping
 BS4_HEADERS = {
@@ -91,6 +111,80 @@ BLOOM_MODEL = "bigscience/bloom-7b1"
 
 FEW_SHOT_EXAMPLES = """Q: To answer "If you want to have some fun, should you try the cinnamon challenge?" what do we first need context about?\nA: what the fun cinnamon challenge is.\n\nQ: To answer "If you are thirsty, should you drink lemonade from a copper vessel?", what do we first need context about?\nA: the interaction between lemonade and the copper vessel.\n\nQ: To answer "If you have want to maintain a healthy relationship, should you treat others with respect and kindness", what do we first need context about?\nA: what treating people with respect and kindness means for healthy relationships.\n\n"""
 DEFAULT_GPT_MODEL = "text-davinci-003"
+DEFAULT_REQUEST_TIMEOUT = 60
+DEFAULT_CONCURRENCY = 1
+DEFAULT_BATCH_SIZE = 1
+MAX_BATCH_SIZE = 20
+
+# ... relating to HTTP connections
+HTTP_CONNECT_TIMEOUT = 10
+HTTP_READ_TIMEOUT = 30
+# keep-alive connections kept, and requests in flight, per host
+HTTP_POOL_SIZE = 16
+
+# ... relating to rate limiting
+GPT_REQUESTS_PER_MINUTE = 3000
+GPT_TOKENS_PER_MINUTE = 250000
+SERP_REQUESTS_PER_MINUTE = 100
+MAX_RETRIES = 6
+BACKOFF_BASE_SECONDS = 1
+BACKOFF_MAX_SECONDS = 60
+RATE_LIMIT_LOG_INTERVAL = 30
+
+# ... relating to caching
+COMPLETION_CACHE_PATH = "./data/cache/completions.sqlite"
+RETRIEVAL_CACHE_PATH = "./data/cache/retrieval.sqlite"
+RETRIEVAL_CACHE_MAX_AGE = 30 * 24 * 60 * 60
+# expired entries and entries beyond max_entries are evicted on open and every this many writes
+CACHE_EVICTION_INTERVAL = 1000
+
+
+# ... relating to prompt construction
+class PromptTemplate(Enum):
+    FOVEATION = "foveation"
+    EXPLANATION = "explanation"
+    AUGMENTED_EXPLANATION = "augmented_explanation"
+    CHAT_EXPLANATION = "chat_explanation"
+
+
+# maximum number of rendered few-shot prefixes kept in memory
+PROMPT_TEMPLATE_CACHE_SIZE = 32
+# characters kept from each augmented snippet
+SNIPPET_MAX_CHARS = 600
+
+# ... relating to retrieval
+NGRAM_FEATURES = 2**12
+NGRAM_RANGE = (1, 2)
+# queries scored at once, bounding the [chunk, NGRAM_FEATURES] query matrix held in memory
+RETRIEVAL_QUERY_CHUNK_SIZE = 256
+FEW_SHOT_INDEX_PATH = "./data/few_shot/rationalization.index.npz"
+BM25_K1 = 1.5
+BM25_B = 0.75
+SHINGLE_SIZE = 3
+MINHASH_PERMUTATIONS = 64
+# estimated Jaccard similarity of shingles above which two snippets are near-duplicates
+NEAR_DUPLICATE_THRESHOLD = 0.6
+MAX_SNIPPETS_PER_DOMAIN = 1
+# attributed examples reranked at once
+RERANK_CHUNK_SIZE = 64
+
+# ... relating to the local knowledge base
+LOCAL_INDEX_PATH = "./data/local_index"
+LOCAL_INDEX_FEATURES = 2**20
+# terms in more than this fraction of documents are dropped from the index like stopwords
+LOCAL_INDEX_MAX_DOCUMENT_FREQUENCY = 0.2
+# ... but only in corpora of at least this many documents
+LOCAL_INDEX_MIN_STOPWORD_DOCUMENTS = 100
+# corpus documents tokenized at once while building
+LOCAL_INDEX_BUILD_CHUNK_SIZE = 10000
+
+# ... relating to metrics
+# upper bounds (seconds) of the request latency histogram buckets
+METRICS_LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# ... relating to checkpointing
+JOURNAL_SUFFIX = ".journal.jsonl"
+PREFIX_TABLE_SUFFIX = ".prefixes.json"
 
 CUDA_VISIBLE_DEVICES = "1"
 
@@ -98,6 +192,16 @@ FEW_SHOT_BASE = """Q: If you are lost in the woods, should you start a forest fi
 
 TOLERANCE = 1e-6
 
+# ... relating to evaluation
+# hub name or local directory of the GPT-2 tokenizer, overridden by the GPT2_TOKENIZER_PATH environment variable
+TOKENIZER_PATH = "gpt2"
+NUM_BOOTSTRAP_SAMPLES = 10000
+NUM_PERMUTATIONS = 10000
+CONFIDENCE_LEVEL = 0.95
+RESAMPLE_SEED = 69
+# resamples drawn at once, bounding the [chunk, num_samples] index matrix held in memory
+RESAMPLE_CHUNK_SIZE = 1000
+
 # ... relating to Stable Diffusion
 DIFFUSION_GENERATION_PATH = "./data/images"
 
@@ -0,0 +1,135 @@
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from util.constants import HTTP_CONNECT_TIMEOUT, HTTP_POOL_SIZE, HTTP_READ_TIMEOUT
+from util.metrics import METRICS
+
+
+class HTTPClient:
+    """
+    shared HTTP client that keeps keep-alive connections pooled per host, so repeated requests
+    skip the TCP and TLS handshakes. safe to share across threads.
+    at most pool_size requests are in flight per host; further requests wait for a free connection.
+    every request is bounded by connect and read timeouts and asks for gzip compressed responses.
+    keeps per host latency counters.
+    """
+
+    def __init__(
+        self,
+        connect_timeout: float = HTTP_CONNECT_TIMEOUT,
+        read_timeout: float = HTTP_READ_TIMEOUT,
+        pool_size: int = HTTP_POOL_SIZE,
+    ):
+        self.timeout = (connect_timeout, read_timeout)
+
+        # one pool of up to pool_size idle connections per host
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session = requests.Session()
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update({"Accept-Encoding": "gzip, deflate"})
+
+        self.pool_size = pool_size
+        self.lock = threading.Lock()
+        self.slots = dict()
+        self.hosts = dict()
+
+    def _slots(self, host: str) -> threading.BoundedSemaphore:
+        """
+        returns the semaphore capping the requests in flight to a host
+        """
+        with self.lock:
+            if host not in self.slots:
+                self.slots[host] = threading.BoundedSemaphore(self.pool_size)
+            return self.slots[host]
+
+    def _record(self, host: str, seconds: float, error: bool):
+        """
+        adds a finished request to the counters of its host
+        """
+        with self.lock:
+            counters = self.hosts.setdefault(
+                host, {"requests": 0, "errors": 0, "seconds": 0.0, "max_seconds": 0.0}
+            )
+            counters["requests"] += 1
+            counters["errors"] += error
+            counters["seconds"] += seconds
+            counters["max_seconds"] = max(counters["max_seconds"], seconds)
+
+    def get(
+        self, url: str, params: dict = None, backend: str = None
+    ) -> requests.Response:
+        """
+        issues a GET request over a pooled connection, raising requests.HTTPError on non-200 responses
+        (and requests.Timeout when the host does not connect or respond in time)
+        the request is tracked in util.metrics under backend (default: the host)
+        """
+        host = urlsplit(url).netloc
+
+        with self._slots(host), METRICS.track(backend or host):
+            start = time.monotonic()
+            try:
+                response = self.session.get(url, params=params, timeout=self.timeout)
+            except Exception:
+                self._record(host, time.monotonic() - start, error=True)
+                raise
+
+            self._record(host, time.monotonic() - start, response.status_code != 200)
+            if response.status_code != 200:
+                raise requests.HTTPError(
+                    f"Response status {response.status_code}", response=response
+                )
+        return response
+
+    def stats(self) -> dict:
+        """
+        returns the request count, error count, and mean and max latency (seconds) of every host
+        """
+        with self.lock:
+            return {
+                host: {
+                    "requests": counters["requests"],
+                    "errors": counters["errors"],
+                    "mean_seconds": counters["seconds"] / counters["requests"],
+                    "max_seconds": counters["max_seconds"],
+                }
+                for host, counters in self.hosts.items()
+            }
+
+    def close(self):
+        self.session.close()
+
+
+# shared by every thread issuing SERP API and Wikipedia requests, see configure_http
+HTTP_CLIENT = HTTPClient()
+
+
+def configure_http(
+    connect_timeout: float = HTTP_CONNECT_TIMEOUT,
+    read_timeout: float = HTTP_READ_TIMEOUT,
+    pool_size: int = HTTP_POOL_SIZE,
+):
+    """
+    replaces the shared HTTP client, e.g. to keep as many connections per host as requests in flight
+    """
+    global HTTP_CLIENT
+    HTTP_CLIENT.close()
+    HTTP_CLIENT = HTTPClient(connect_timeout, read_timeout, pool_size)
+
+
+def http_get(url: str, params: dict = None, backend: str = None) -> requests.Response:
+    """
+    issues a GET request through the shared HTTP client (see HTTPClient.get)
+    """
+    return HTTP_CLIENT.get(url, params=params, backend=backend)
+
+
+def http_stats() -> dict:
+    """
+    returns per host latency statistics of the shared HTTP client, or None before any request
+    """
+    return HTTP_CLIENT.stats() or None
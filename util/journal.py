@@ -0,0 +1,97 @@
+import json
+import os
+import threading
+
+
+def is_error(result: any) -> bool:
+    """
+    checks whether a stored result is an error record
+    """
+    return isinstance(result, dict) and "error" in result
+
+
+class Journal:
+    """
+    append-only JSONL checkpoint of per-sample results, one {"index": ..., "fields": {...}} line per sample.
+    use resume=True to keep previously journaled results; otherwise the journal starts empty.
+    later lines for the same index override earlier ones.
+    only the file offset of each result is held in memory; fields are read back from disk on demand.
+    safe to share across threads.
+    """
+
+    def __init__(self, path: str, resume: bool = False):
+        self.path = path
+        self.lock = threading.Lock()
+        self.offsets = dict()
+        self.failed = set()
+
+        if resume and os.path.exists(path):
+            with open(path, "rb") as file:
+                offset = 0
+                for line in file:
+                    try:
+                        self._index(json.loads(line), offset)
+                    except json.JSONDecodeError:
+                        # a crash mid-write can leave a truncated last line
+                        pass
+                    offset += len(line)
+
+        self.file = open(path, "ab" if resume else "wb")
+        self.file.seek(0, os.SEEK_END)
+
+        # terminate a truncated last line so appended results start on a fresh line
+        if self.file.tell() > 0:
+            with open(path, "rb") as file:
+                file.seek(-1, os.SEEK_END)
+                if file.read(1) != b"\n":
+                    self.file.write(b"\n")
+
+        self.reader = open(path, "rb")
+
+    def _index(self, entry: dict, offset: int):
+        self.offsets[entry["index"]] = offset
+        if any(is_error(value) for value in entry["fields"].values()):
+            self.failed.add(entry["index"])
+        else:
+            self.failed.discard(entry["index"])
+
+    def done(self, index: int) -> bool:
+        """
+        checks whether a sample has a journaled result that is not an error
+        """
+        return index in self.offsets and index not in self.failed
+
+    def record(self, index: int, fields: dict):
+        """
+        appends the result fields of a sample and flushes them to disk
+        """
+        entry = {"index": index, "fields": fields}
+        line = (json.dumps(entry) + "\n").encode("utf-8")
+        with self.lock:
+            offset = self.file.tell()
+            self.file.write(line)
+            self.file.flush()
+            self._index(entry, offset)
+
+    def fields(self, index: int) -> dict:
+        """
+        returns the journaled result fields of a sample (empty if there are none)
+        """
+        with self.lock:
+            if index not in self.offsets:
+                return dict()
+
+            self.reader.seek(self.offsets[index])
+            line = self.reader.readline()
+        return json.loads(line)["fields"]
+
+    def apply(self, examples):
+        """
+        lazily assembles the journaled result fields into the examples
+        """
+        for index, sample in enumerate(examples):
+            yield {**sample, **self.fields(index)}
+
+    def close(self):
+        self.file.close()
+        self.reader.close()
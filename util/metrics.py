@@ -0,0 +1,269 @@
+import bisect
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from util.constants import METRICS_LATENCY_BUCKETS
+
+# counters kept per phase and backend, exposed to Prometheus as farm_<name>_total
+COUNTERS = [
+    "retries",
+    "prompt_tokens",
+    "completion_tokens",
+    "cache_hits",
+    "cache_misses",
+]
+
+
+def status_code(e: Exception) -> int:
+    """
+    returns the HTTP status code attached to an openai or requests exception, if any
+    """
+    status = getattr(e, "http_status", None)
+    if status is None and getattr(e, "response", None) is not None:
+        status = e.response.status_code
+    return status
+
+
+def error_class(e: Exception) -> str:
+    """
+    returns the class an error is counted under (i.e., its type, with its HTTP status if any)
+    """
+    status = status_code(e)
+    return type(e).__name__ if status is None else f"{type(e).__name__} {status}"
+
+
+class Histogram:
+    """
+    cumulative histogram of latencies (seconds) over fixed bucket upper bounds, as exposed to Prometheus
+    """
+
+    def __init__(self, buckets: tuple = METRICS_LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def cumulative(self) -> list:
+        """
+        returns the number of observations at most each bucket bound, the last being all observations
+        """
+        totals, total = list(), 0
+        for count in self.counts:
+            total += count
+            totals.append(total)
+        return totals
+
+    def quantile(self, q: float) -> float:
+        """
+        returns the upper bound of the bucket holding the q-th quantile (inf beyond the last bucket)
+        """
+        for bound, total in zip(self.buckets + (float("inf"),), self.cumulative()):
+            if total >= q * self.count:
+                return bound
+        return float("inf")
+
+    def summary(self) -> dict:
+        return {
+            "count": self.count,
+            "mean_seconds": self.sum / self.count if self.count else None,
+            "p50_seconds": self.quantile(0.5) if self.count else None,
+            "p99_seconds": self.quantile(0.99) if self.count else None,
+            "buckets": {
+                str(bound): total
+                for bound, total in zip(self.buckets + ("+Inf",), self.cumulative())
+            },
+        }
+
+
+class Metrics:
+    """
+    thread-safe registry of request metrics per phase and backend (i.e., gpt, serp, wikipedia):
+    latency histograms, requests in flight, errors by class, and the COUNTERS.
+    the phase is the one the current main.py run was started with, see set_phase.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.phase = "none"
+        self.started = time.time()
+        self.latencies = defaultdict(Histogram)
+        self.in_flight = defaultdict(int)
+        self.max_in_flight = defaultdict(int)
+        self.counters = defaultdict(int)
+        self.errors = defaultdict(int)
+
+    def set_phase(self, phase: str):
+        with self.lock:
+            self.phase = phase
+
+    def increment(self, backend: str, name: str, value: int = 1):
+        """
+        adds value to one of the COUNTERS of a backend
+        """
+        with self.lock:
+            self.counters[(self.phase, backend, name)] += value
+
+    def error(self, backend: str, e: Exception):
+        """
+        counts a failed request of a backend by its error class
+        """
+        with self.lock:
+            self.errors[(self.phase, backend, error_class(e))] += 1
+
+    @contextmanager
+    def track(self, backend: str):
+        """
+        times a request to a backend, counting it in flight until it finishes and counting its error if it raises
+        """
+        with self.lock:
+            key = (self.phase, backend)
+            self.in_flight[key] += 1
+            self.max_in_flight[key] = max(self.max_in_flight[key], self.in_flight[key])
+
+        start = time.monotonic()
+        try:
+            yield
+        except Exception as e:
+            self.error(backend, e)
+            raise
+        finally:
+            with self.lock:
+                self.in_flight[key] -= 1
+                self.latencies[key].observe(time.monotonic() - start)
+
+    def _keys(self) -> list:
+        """
+        returns every (phase, backend) with recorded metrics
+        """
+        return sorted(
+            set(self.latencies)
+            | {key[:2] for key in self.counters}
+            | {key[:2] for key in self.errors}
+        )
+
+    def summary(self) -> dict:
+        """
+        returns {phase: {backend: metrics}}
+        """
+        with self.lock:
+            phases = defaultdict(dict)
+            for phase, backend in self._keys():
+                phases[phase][backend] = {
+                    "latency": self.latencies[(phase, backend)].summary(),
+                    "in_flight": self.in_flight[(phase, backend)],
+                    "max_in_flight": self.max_in_flight[(phase, backend)],
+                    **{
+                        name: self.counters[(phase, backend, name)] for name in COUNTERS
+                    },
+                    "errors": {
+                        error: count
+                        for (p, b, error), count in self.errors.items()
+                        if (p, b) == (phase, backend)
+                    },
+                }
+            return dict(phases)
+
+    def prometheus(self) -> str:
+        """
+        returns the metrics in the Prometheus text exposition format
+        """
+        with self.lock:
+            keys = self._keys()
+            lines = ["# TYPE farm_request_seconds histogram"]
+            for phase, backend in keys:
+                labels = f'phase="{phase}",backend="{backend}"'
+                histogram = self.latencies[(phase, backend)]
+                for bound, total in zip(
+                    histogram.buckets + ("+Inf",), histogram.cumulative()
+                ):
+                    lines.append(
+                        f'farm_request_seconds_bucket{{{labels},le="{bound}"}} {total}'
+                    )
+                lines.append(f"farm_request_seconds_sum{{{labels}}} {histogram.sum}")
+                lines.append(
+                    f"farm_request_seconds_count{{{labels}}} {histogram.count}"
+                )
+
+            lines.append("# TYPE farm_requests_in_flight gauge")
+            for phase, backend in keys:
+                lines.append(
+                    f'farm_requests_in_flight{{phase="{phase}",backend="{backend}"}} '
+                    f"{self.in_flight[(phase, backend)]}"
+                )
+
+            for name in COUNTERS:
+                lines.append(f"# TYPE farm_{name}_total counter")
+                for phase, backend in keys:
+                    lines.append(
+                        f'farm_{name}_total{{phase="{phase}",backend="{backend}"}} '
+                        f"{self.counters[(phase, backend, name)]}"
+                    )
+
+            lines.append("# TYPE farm_errors_total counter")
+            for (phase, backend, error), count in sorted(self.errors.items()):
+                lines.append(
+                    f'farm_errors_total{{phase="{phase}",backend="{backend}",error="{error}"}} {count}'
+                )
+
+        return "\n".join(lines) + "\n"
+
+    def write_summary(self, path: str, **run):
+        """
+        writes the summary, along with fields describing the run, as JSON to path
+        """
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        file = open(path, "w")
+        json.dump(
+            {
+                **run,
+                "started": self.started,
+                "seconds": time.time() - self.started,
+                "phases": self.summary(),
+            },
+            file,
+            indent=2,
+        )
+        file.close()
+
+
+# shared by every thread issuing requests
+METRICS = Metrics()
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.startswith("/metrics"):
+            body = METRICS.prometheus().encode("utf-8")
+            content_type = "text/plain; version=0.0.4"
+        else:
+            body = json.dumps(METRICS.summary(), indent=2).encode("utf-8")
+            content_type = "application/json"
+
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def serve_metrics(port: int) -> ThreadingHTTPServer:
+    """
+    serves live metrics on a background thread: Prometheus text at /metrics, the JSON summary anywhere else
+    """
+    server = ThreadingHTTPServer(("", port), _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
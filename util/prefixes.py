@@ -0,0 +1,87 @@
+import hashlib
+import json
+import os
+
+# content hash -> few-shot prompt prefix, filled in as prompts are built
+PREFIXES = dict()
+
+
+def register_prefix(prefix: str) -> str:
+    """
+    registers a few-shot prompt prefix and returns its content hash
+    """
+    key = hashlib.sha256(prefix.encode("utf-8")).hexdigest()[:16]
+    PREFIXES[key] = prefix
+    return key
+
+
+def compact_prompt(prompt: str):
+    """
+    replaces the longest registered prefix of a prompt with a reference to its hash
+    (i.e., returns {"prefix": hash, "suffix": rest of prompt}), or the prompt itself if none match
+    """
+    matches = [
+        (len(prefix), key)
+        for key, prefix in PREFIXES.items()
+        if prefix and prompt.startswith(prefix)
+    ]
+    if not matches:
+        return prompt
+
+    length, key = max(matches)
+    return {"prefix": key, "suffix": prompt[length:]}
+
+
+def expand_prompt(prompt, table: dict) -> str:
+    """
+    restores a compacted prompt from a prefix table
+    """
+    if isinstance(prompt, dict):
+        return table[prompt["prefix"]] + prompt["suffix"]
+    return prompt
+
+
+def collect_prefixes(records, referenced: set):
+    """
+    lazily passes records through, adding the prefix hashes referenced by their error records to referenced
+    """
+    for record in records:
+        for value in record.values():
+            if isinstance(value, dict) and isinstance(value.get("prompt"), dict):
+                referenced.add(value["prompt"]["prefix"])
+        yield record
+
+
+def save_prefix_table(referenced: set, path: str):
+    """
+    writes the referenced prefixes into a sidecar table at path, merged with any existing table
+    """
+    if not referenced:
+        return
+
+    table = dict()
+    if os.path.exists(path):
+        table = json.load(open(path, "r"))
+
+    table.update({key: PREFIXES[key] for key in referenced if key in PREFIXES})
+
+    file = open(path, "w")
+    json.dump(table, file, indent=2)
+    file.close()
+
+
+def load_prefix_table(path: str) -> dict:
+    """
+    reads a sidecar prefix table, empty if there is none
+    """
+    if not os.path.exists(path):
+        return dict()
+    return json.load(open(path, "r"))
+
+
+def register_prefix_table(path: str):
+    """
+    registers the prefixes of a sidecar table, so error records copied from its records file
+    (e.g., a failed foveation carried into the attributions) resolve in the tables written downstream
+    """
+    PREFIXES.update(load_prefix_table(path))
@@ -0,0 +1,215 @@
+import random
+import threading
+import time
+from typing import Callable
+
+from util.constants import (
+    BACKOFF_BASE_SECONDS,
+    BACKOFF_MAX_SECONDS,
+    MAX_RETRIES,
+    RATE_LIMIT_LOG_INTERVAL,
+)
+from util.metrics import METRICS, status_code
+
+RETRYABLE_ERRORS = {
+    "APIConnectionError",
+    "ConnectionError",
+    "ConnectTimeout",
+    "RateLimitError",
+    "ReadTimeout",
+    "ServiceUnavailableError",
+    "Timeout",
+}
+
+
+class RateLimiter:
+    """
+    token-bucket limiter that budgets requests per minute and (optionally) tokens per minute.
+    shared across threads; acquire() blocks until both budgets allow the call.
+    keeps running counters of the observed throughput.
+    """
+
+    def __init__(
+        self, name: str, requests_per_minute: int, tokens_per_minute: int = None
+    ):
+        self.name = name
+        self.lock = threading.Lock()
+        self.configure(requests_per_minute, tokens_per_minute)
+
+        self.started = time.monotonic()
+        self.last_logged = self.started
+        self.requests = 0
+        self.tokens = 0
+        self.retries = 0
+        self.throttled = 0
+
+    def configure(self, requests_per_minute: int, tokens_per_minute: int = None):
+        """
+        (re)sets the per minute budgets and fills both buckets
+        """
+        with self.lock:
+            self.requests_per_minute = requests_per_minute
+            self.tokens_per_minute = tokens_per_minute
+            self.request_budget = float(requests_per_minute)
+            self.token_budget = float(tokens_per_minute or 0)
+            self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        """
+        adds the budget accrued since the last update, capped at one minute's worth
+        """
+        elapsed = now - self.updated
+        self.updated = now
+        self.request_budget = min(
+            self.requests_per_minute,
+            self.request_budget + elapsed * self.requests_per_minute / 60,
+        )
+        if self.tokens_per_minute:
+            self.token_budget = min(
+                self.tokens_per_minute,
+                self.token_budget + elapsed * self.tokens_per_minute / 60,
+            )
+
+    def acquire(self, tokens: int = 0):
+        """
+        blocks until a request costing `tokens` tokens fits in both budgets, then spends it
+        """
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self._refill(now)
+
+                # a single request larger than the whole bucket only waits for a full bucket
+                cost = min(tokens, self.tokens_per_minute or 0)
+                if self.request_budget >= 1 and self.token_budget >= cost:
+                    self.request_budget -= 1
+                    self.token_budget -= cost
+                    self.requests += 1
+                    self.tokens += tokens
+                    self._log(now)
+                    return
+
+                wait = (1 - self.request_budget) * 60 / self.requests_per_minute
+                if self.tokens_per_minute:
+                    wait = max(
+                        wait,
+                        (cost - self.token_budget) * 60 / self.tokens_per_minute,
+                    )
+
+            time.sleep(max(wait, 0.01))
+
+    def throttle(self, delay: float):
+        """
+        records a rate limit response and empties the buckets so every caller pauses for `delay`
+        """
+        with self.lock:
+            # credit the time up to now first, so the next refill cannot cancel the pause
+            self._refill(time.monotonic())
+            self.throttled += 1
+            self.request_budget = min(
+                self.request_budget, -delay * self.requests_per_minute / 60
+            )
+            if self.tokens_per_minute:
+                self.token_budget = min(
+                    self.token_budget, -delay * self.tokens_per_minute / 60
+                )
+
+    def stats(self) -> dict:
+        """
+        returns the live throughput counters
+        """
+        minutes = max(time.monotonic() - self.started, 1e-9) / 60
+        return {
+            "requests": self.requests,
+            "tokens": self.tokens,
+            "retries": self.retries,
+            "throttled": self.throttled,
+            "requests_per_minute": self.requests / minutes,
+            "tokens_per_minute": self.tokens / minutes,
+        }
+
+    def _log(self, now: float):
+        """
+        periodically prints throughput while a long run is in progress
+        """
+        if now - self.last_logged < RATE_LIMIT_LOG_INTERVAL:
+            return
+
+        self.last_logged = now
+        minutes = max(now - self.started, 1e-9) / 60
+        print(
+            f"{self.name}: {self.requests} requests ({self.requests / minutes:.0f}/min), "
+            f"{self.tokens} tokens ({self.tokens / minutes:.0f}/min), "
+            f"{self.retries} retries, {self.throttled} throttled"
+        )
+
+
+def _retry_after(e: Exception) -> float:
+    """
+    returns the server requested delay in seconds, if any
+    """
+    headers = getattr(e, "headers", None)
+    if headers is None and getattr(e, "response", None) is not None:
+        headers = e.response.headers
+
+    try:
+        return float(headers["Retry-After"])
+    except:
+        return None
+
+
+def is_retryable(e: Exception) -> bool:
+    """
+    checks whether an error is transient (rate limit, server error, or network failure)
+    """
+    status = status_code(e)
+    if status is not None:
+        return status == 429 or status >= 500
+
+    return type(e).__name__ in RETRYABLE_ERRORS
+
+
+def call_with_backoff(
+    fn: Callable, limiter: RateLimiter, tokens: int = 0, max_retries: int = MAX_RETRIES
+):
+    """
+    calls fn once the limiter allows it.
+    retries transient failures with jittered exponential backoff (or at least the server's Retry-After);
+    re-raises anything else.
+    """
+    for attempt in range(max_retries + 1):
+        limiter.acquire(tokens)
+
+        try:
+            return fn()
+
+        except Exception as e:
+            if attempt == max_retries or not is_retryable(e):
+                raise
+
+            # a server requested delay is only ever jittered upwards
+            retry_after = _retry_after(e)
+            if retry_after is not None:
+                delay = retry_after * random.uniform(1, 1.5)
+            else:
+                delay = min(
+                    BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2**attempt
+                ) * random.uniform(0.5, 1.5)
+
+            with limiter.lock:
+                limiter.retries += 1
+            METRICS.increment(limiter.name, "retries")
+            print(f"RETRY {attempt + 1}/{max_retries} in {delay:.1f}s: {e}")
+
+            # on a rate limit every caller pauses, this one included, by waiting on the emptied buckets
+            if status_code(e) == 429:
+                limiter.throttle(delay)
+            else:
+                time.sleep(delay)
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    cheap estimate of the number of tokens in a piece of text (~4 characters per token)
+    """
+    return len(text) // 4 + 1
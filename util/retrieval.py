@@ -0,0 +1,263 @@
+import hashlib
+import re
+import zlib
+import numpy as np
+from util.constants import (
+    BM25_B,
+    BM25_K1,
+    MINHASH_PERMUTATIONS,
+    NGRAM_FEATURES,
+    NGRAM_RANGE,
+    RETRIEVAL_QUERY_CHUNK_SIZE,
+    RESAMPLE_SEED,
+    SHINGLE_SIZE,
+)
+
+# modulus of the MinHash permutations, a Mersenne prime above every 32-bit shingle hash
+MERSENNE_PRIME = (1 << 61) - 1
+
+
+def tokenize(text: str) -> list:
+    """
+    lowercases a text and splits it into alphanumeric word tokens
+    """
+    return re.findall(r"[a-z0-9]+", text.lower())
+
+
+def _hashed_ngrams(text: str, num_features: int, ngram_range: tuple) -> list:
+    """
+    returns the feature index of every word n-gram in a text.
+    n-grams are hashed with crc32 (not hash(), which is salted per process), so persisted vectors stay valid.
+    """
+    tokens = tokenize(text)
+    low, high = ngram_range
+    return [
+        zlib.crc32(token.encode("utf-8")) % num_features
+        for token in (tokens if low == 1 else [])
+    ] + [
+        zlib.crc32(" ".join(tokens[i : i + n]).encode("utf-8")) % num_features
+        for n in range(max(low, 2), high + 1)
+        for i in range(len(tokens) - n + 1)
+    ]
+
+
+def _term_frequencies(texts: list, num_features: int, ngram_range: tuple) -> np.array:
+    """
+    returns the [len(texts), num_features] matrix of hashed n-gram counts
+    """
+    features = [_hashed_ngrams(text, num_features, ngram_range) for text in texts]
+    rows = np.repeat(np.arange(len(texts)), [len(row) for row in features])
+    cells = rows * num_features + np.array(
+        [feature for row in features for feature in row], dtype=np.int64
+    )
+
+    return (
+        np.bincount(cells, minlength=len(texts) * num_features)
+        .reshape(len(texts), num_features)
+        .astype(np.float32)
+    )
+
+
+def _normalize(vectors: np.array) -> np.array:
+    """
+    scales every row to unit length (zero rows stay zero)
+    """
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+def content_hash(data: bytes) -> str:
+    """
+    returns a content hash identifying the corpus an index was built from
+    """
+    return hashlib.sha256(data).hexdigest()
+
+
+class VectorIndex:
+    """
+    nearest neighbour index of TF-IDF weighted, hashed word n-gram vectors (cosine similarity).
+    small enough to hold densely in memory; persisted as a single '.npz' file.
+    """
+
+    def __init__(
+        self,
+        vectors: np.array,
+        idf: np.array,
+        ngram_range: tuple = NGRAM_RANGE,
+        fingerprint: str = "",
+    ):
+        self.vectors = vectors
+        self.idf = idf
+        self.ngram_range = tuple(ngram_range)
+        self.fingerprint = fingerprint
+
+    @classmethod
+    def build(
+        cls,
+        texts: list,
+        num_features: int = NGRAM_FEATURES,
+        ngram_range: tuple = NGRAM_RANGE,
+        fingerprint: str = "",
+    ):
+        """
+        indexes texts; fingerprint identifies the corpus they came from (see content_hash)
+        """
+        frequencies = _term_frequencies(texts, num_features, ngram_range)
+        document_frequencies = np.count_nonzero(frequencies, axis=0)
+        idf = (np.log((1 + len(texts)) / (1 + document_frequencies)) + 1).astype(
+            np.float32
+        )
+
+        return cls(_normalize(frequencies * idf), idf, ngram_range, fingerprint)
+
+    @classmethod
+    def load(cls, path: str):
+        data = np.load(path)
+        return cls(
+            data["vectors"],
+            data["idf"],
+            tuple(data["ngram_range"]),
+            str(data["fingerprint"]),
+        )
+
+    def save(self, path: str):
+        # write through a file object so numpy does not append another '.npz'
+        with open(path, "wb") as file:
+            np.savez(
+                file,
+                vectors=self.vectors,
+                idf=self.idf,
+                ngram_range=np.array(self.ngram_range),
+                fingerprint=np.array(self.fingerprint),
+            )
+
+    def vectorize(self, texts: list) -> np.array:
+        """
+        embeds texts into the index's vector space
+        """
+        frequencies = _term_frequencies(texts, len(self.idf), self.ngram_range)
+        return _normalize(frequencies * self.idf)
+
+    def top_k(self, queries: list, k: int) -> np.array:
+        """
+        returns the [len(queries), k] indices of the most similar indexed texts, most similar first.
+        queries are scored against the whole index with one matrix multiply per chunk of queries.
+        """
+        k = min(k, len(self.vectors))
+        results = np.empty((len(queries), k), dtype=np.int64)
+
+        for start in range(0, len(queries), RETRIEVAL_QUERY_CHUNK_SIZE):
+            chunk = queries[start : start + RETRIEVAL_QUERY_CHUNK_SIZE]
+            scores = self.vectorize(chunk) @ self.vectors.T
+
+            # ties go to the earlier text, matching the fixed few-shot order
+            results[start : start + len(chunk)] = np.argsort(
+                -scores, axis=1, kind="stable"
+            )[:, :k]
+
+        return results
+
+
+def _shingles(text: str, size: int) -> list:
+    """
+    returns the crc32 hashes of the word shingles (runs of size words) of a text
+    (a text shorter than size words is a single shingle)
+    """
+    tokens = tokenize(text)
+    return [
+        zlib.crc32(" ".join(tokens[i : i + size]).encode("utf-8"))
+        for i in range(max(1, len(tokens) - size + 1))
+    ]
+
+
+def minhash_signatures(
+    texts: list,
+    num_permutations: int = MINHASH_PERMUTATIONS,
+    shingle_size: int = SHINGLE_SIZE,
+    seed: int = RESAMPLE_SEED,
+) -> np.array:
+    """
+    returns the [len(texts), num_permutations] MinHash signatures of the texts' word shingles.
+    the fraction of equal entries in two signatures estimates the Jaccard similarity of their shingles.
+    every shingle of every text is permuted at once, then reduced per text.
+    """
+    shingles = [_shingles(text, shingle_size) for text in texts]
+    if not shingles:
+        return np.zeros((0, num_permutations), dtype=np.uint64)
+
+    hashes = np.array([h for text in shingles for h in text], dtype=np.uint64)
+    offsets = np.cumsum([0] + [len(text) for text in shingles[:-1]])
+
+    # universal hashing (a * h + b) mod p stands in for a random permutation; a, h < 2^32 so a * h cannot overflow
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, 1 << 32, size=(num_permutations, 1), dtype=np.uint64)
+    b = rng.integers(0, 1 << 32, size=(num_permutations, 1), dtype=np.uint64)
+    permuted = (a * hashes + b) % np.uint64(MERSENNE_PRIME)
+
+    return np.minimum.reduceat(permuted, offsets, axis=1).T
+
+
+def jaccard_estimates(signature: np.array, signatures: np.array) -> np.array:
+    """
+    estimates the Jaccard similarity between one MinHash signature and each of several others
+    """
+    return (signatures == signature).mean(axis=1)
+
+
+class BM25:
+    """
+    Okapi BM25 scorer over hashed word unigrams.
+    corpus statistics are accumulated with add (so a corpus can be streamed through in chunks),
+    then documents are scored against queries with score.
+    """
+
+    def __init__(
+        self,
+        num_features: int = NGRAM_FEATURES,
+        k1: float = BM25_K1,
+        b: float = BM25_B,
+    ):
+        self.num_features = num_features
+        self.k1 = k1
+        self.b = b
+        self.document_frequencies = np.zeros(num_features, dtype=np.int64)
+        self.num_documents = 0
+        self.total_length = 0
+
+    def _frequencies(self, texts: list) -> np.array:
+        return _term_frequencies(texts, self.num_features, (1, 1))
+
+    def add(self, texts: list):
+        """
+        adds documents to the corpus statistics
+        """
+        frequencies = self._frequencies(texts)
+        self.document_frequencies += np.count_nonzero(frequencies, axis=0)
+        self.num_documents += len(texts)
+        self.total_length += int(frequencies.sum())
+
+    def score(self, queries: list, documents: list, owners: list) -> np.array:
+        """
+        returns the BM25 score of every document against the query at its owner's index
+        """
+        if not documents:
+            return np.zeros(0)
+
+        idf = np.log(
+            1
+            + (self.num_documents - self.document_frequencies + 0.5)
+            / (self.document_frequencies + 0.5)
+        )
+        average_length = self.total_length / max(self.num_documents, 1) or 1
+
+        frequencies = self._frequencies(documents)
+        lengths = frequencies.sum(axis=1, keepdims=True)
+        saturated = (
+            frequencies
+            * (self.k1 + 1)
+            / (frequencies + self.k1 * (1 - self.b + self.b * lengths / average_length))
+        )
+
+        # a query term counts once, however often it repeats
+        terms = self._frequencies(queries) > 0
+        return np.einsum("df,df->d", saturated * idf, terms[np.asarray(owners)])
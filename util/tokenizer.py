@@ -0,0 +1,62 @@
+import os
+import threading
+from util.constants import TOKENIZER_PATH
+
+# loaded on first use, see get_tokenizer
+TOKENIZER = None
+
+# fast tokenizers must not be used from several threads at once
+TOKENIZER_LOCK = threading.Lock()
+
+# memoized token counts by text, see count_tokens
+TOKEN_COUNTS = dict()
+
+
+def get_tokenizer():
+    """
+    loads the GPT-2 tokenizer on first use from GPT2_TOKENIZER_PATH (a local directory) or TOKENIZER_PATH.
+    a copy already in the local Hugging Face cache is preferred, so the hub is only contacted when there is none.
+    """
+    global TOKENIZER
+    if TOKENIZER is not None:
+        return TOKENIZER
+
+    # importing transformers is slow, so only pay for it when tokenizing
+    from transformers import GPT2TokenizerFast
+
+    path = os.getenv("GPT2_TOKENIZER_PATH", TOKENIZER_PATH)
+    try:
+        TOKENIZER = GPT2TokenizerFast.from_pretrained(path, local_files_only=True)
+    except OSError:
+        TOKENIZER = GPT2TokenizerFast.from_pretrained(path)
+
+    return TOKENIZER
+
+
+def encode(texts: list) -> list:
+    """
+    returns the GPT-2 token ids of each text, encoded in a single batched call
+    """
+    with TOKENIZER_LOCK:
+        return get_tokenizer()(texts)["input_ids"]
+
+
+def count_tokens(texts: list) -> list:
+    """
+    returns the number of GPT-2 tokens in each text.
+    texts not counted before are encoded in a single batched call; counts are memoized by text,
+    so only use this for texts that repeat (e.g., completions or few-shot prefixes).
+    """
+    missing = [text for text in dict.fromkeys(texts) if text not in TOKEN_COUNTS]
+    if missing:
+        for text, ids in zip(missing, encode(missing)):
+            TOKEN_COUNTS[text] = len(ids)
+
+    return [TOKEN_COUNTS[text] for text in texts]
+
+
+def num_tokens(text: str) -> int:
+    """
+    returns the number of GPT-2 tokens in a single text, without memoizing it
+    """
+    return len(encode([text])[0])
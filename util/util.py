@@ -1,18 +1,30 @@
+import csv
 import json
+import os
+import re
 from enum import Enum
+from functools import lru_cache
+from itertools import islice
 import random
+import textwrap
 
 random.seed(69)
 
 from models.gpt import check_success, gpt_completion_request
-from util.constants import AttributionSource, Domain
-
-
-# one-time load global constants
-FEW_SHOT_FOVEATIONS = None
-FEW_SHOT_EXPLANATIONS = None
-CHAT_FEW_SHOT_EXPLANATIONS = None
-FEW_SHOT_AUGMENTATIONS = None
+from util.constants import (
+    FEW_SHOT_INDEX_PATH,
+    MAX_SNIPPETS_PER_DOMAIN,
+    NEAR_DUPLICATE_THRESHOLD,
+    PREFIX_TABLE_SUFFIX,
+    PROMPT_TEMPLATE_CACHE_SIZE,
+    RERANK_CHUNK_SIZE,
+    SNIPPET_MAX_CHARS,
+    AttributionSource,
+    Domain,
+    PromptTemplate,
+)
+from util.prefixes import register_prefix, register_prefix_table
+from util.tokenizer import count_tokens, num_tokens
 
 
 def safety_conditional(safe: bool) -> str:
@@ -35,12 +47,21 @@ def _extract_source(url: str) -> str:
     return url.replace("https://", "").replace("http://", "").split("/")[0]
 
 
+@lru_cache(maxsize=None)
+def _read_few_shot_file(name: str) -> list:
+    """
+    returns the few-shot examples in './data/few_shot/{name}.json', read once per process
+    """
+    return json.load(open(f"./data/few_shot/{name}.json", "r"))
+
+
 def _read_few_shot_foveations(k: int = 16) -> str:
     """
     returns k-shot foveations
+    (registered as a prompt prefix, so stored error records reference it by hash)
     """
-    examples = json.load(open(f"./data/few_shot/foveation.json", "r"))
-    return (
+    examples = _read_few_shot_file("foveation")
+    prefix = (
         "\n\n".join(
             [
                 f"""{context_prompt(prompt=examples[i]["prompt"], advice=examples[i]["advice"], few_shot=False)} {examples[i]["foveation"][0]["completion"]}"""
@@ -49,17 +70,28 @@ def _read_few_shot_foveations(k: int = 16) -> str:
         )
         + "\n\n"
     )
+    register_prefix(prefix)
+    return prefix
 
 
 def _read_few_shot_explanations(
     augment: bool,
     num_sources: int = None,
     num_examples: int = 8,
+    example_indices: tuple = None,
 ) -> str:
     """
     return k-shot explanations
-    """
-    examples = json.load(open(f"./data/few_shot/rationalization.json", "r"))
+    uses the first num_examples examples, or the first num_examples of example_indices (ordered most relevant first,
+    see select_few_shot_examples) placed so the most relevant example is closest to the question
+    (fixed prefixes are registered as prompt prefixes, so stored error records reference them by hash)
+    """
+    examples = _read_few_shot_file("rationalization")
+    selected = (
+        range(num_examples)
+        if example_indices is None
+        else example_indices[:num_examples][::-1]
+    )
 
     snippets = None
 
@@ -68,16 +100,21 @@ def _read_few_shot_explanations(
 
         snippets = [
             f"""{augment_snippets(snippets=examples[i]["attribution"], num_sources=num_sources)}\nQ: {base_scenario(prompt=examples[i]["prompt"], advice=examples[i]["advice"])}\nA: {examples[i]["explanation"][0]["completion"]}"""
-            for i in range(num_examples)
+            for i in selected
         ]
 
     else:
         snippets = [
             f"""Q: {base_scenario(prompt=examples[i]["prompt"], advice=examples[i]["advice"])}\nA: {examples[i]["explanation"][0]["completion"]}"""
-            for i in range(num_examples)
+            for i in selected
         ]
 
-    return "\n\n".join(snippets) + "\n\n"
+    prefix = "\n\n".join(snippets) + "\n\n"
+
+    # selected prefixes differ per sample, so there is nothing to deduplicate
+    if example_indices is None:
+        register_prefix(prefix)
+    return prefix
 
 
 def _chat_few_shot_explanations(
@@ -88,7 +125,7 @@ def _chat_few_shot_explanations(
     """
     return k-shot explanations
     """
-    examples = json.load(open(f"./data/few_shot/rationalization.json", "r"))
+    examples = _read_few_shot_file("rationalization")
     messages = list()
 
     for i in range(num_examples):
@@ -108,14 +145,104 @@ def _chat_few_shot_explanations(
     return messages
 
 
-def read_base_examples(safe: bool, domain: Domain = None) -> list:
+@lru_cache(maxsize=PROMPT_TEMPLATE_CACHE_SIZE)
+def few_shot_prefix(
+    template: PromptTemplate,
+    k: int,
+    num_sources: int = None,
+    example_indices: tuple = None,
+):
     """
-    reads safe/unsafe base scenarios and returns parsed scenarios in list format.
+    returns the rendered k-shot prefix of a prompt template (augmented explanations use num_sources snippets).
+    explanation templates take their examples from example_indices when given (see select_few_shot_examples).
+    memoized by (template, k, num_sources, example_indices), evicting the least recently used of PROMPT_TEMPLATE_CACHE_SIZE prefixes,
+    so prompts for several configurations can be built in one process.
+    """
+    if template == PromptTemplate.FOVEATION:
+        return _read_few_shot_foveations(k)
+    if template == PromptTemplate.EXPLANATION:
+        return _read_few_shot_explanations(
+            augment=False, num_examples=k, example_indices=example_indices
+        )
+    if template == PromptTemplate.AUGMENTED_EXPLANATION:
+        return _read_few_shot_explanations(
+            augment=True,
+            num_sources=num_sources,
+            num_examples=k,
+            example_indices=example_indices,
+        )
+    if template == PromptTemplate.CHAT_EXPLANATION:
+        return _chat_few_shot_explanations(augment=False, num_examples=k)
+
+    raise ValueError(f"unknown prompt template {template}")
+
+
+def _resolve_path(path: str) -> str:
+    """
+    given a '.json' path, returns the most recently written of its '.jsonl' and '.json' variants
+    """
+    candidates = [
+        candidate
+        for candidate in (path[: -len(".json")] + ".jsonl", path)
+        if os.path.exists(candidate)
+    ]
+    if not candidates:
+        return path
+
+    return max(candidates, key=os.path.getmtime)
+
+
+def read_records(path: str):
+    """
+    lazily yields the records stored at path.
+    '.jsonl' files are streamed one line at a time; '.json' files hold a single list of records.
+    the prefixes of the file's sidecar table are registered, so its error records can be written downstream.
+    """
+    register_prefix_table(path.replace(".json", PREFIX_TABLE_SUFFIX))
+    path = _resolve_path(path)
+
+    with open(path, "r") as file:
+        if not path.endswith(".jsonl"):
+            yield from json.load(file)
+            return
+
+        for line in file:
+            if line.strip():
+                yield json.loads(line)
+
+
+def write_records(records, path: str, output_format: str = "jsonl") -> str:
+    """
+    incrementally writes records to path (a '.json' path), one record at a time.
+    output_format='jsonl' writes one record per line; output_format='json' writes the indented list layout.
+    returns the path written to.
+    """
+    if output_format == "jsonl":
+        path = path[: -len(".json")] + ".jsonl"
+
+    with open(path, "w") as file:
+        if output_format == "jsonl":
+            for record in records:
+                file.write(json.dumps(record) + "\n")
+            return path
+
+        # same layout as json.dump(records, file, indent=2)
+        empty = True
+        for record in records:
+            file.write("[\n" if empty else ",\n")
+            file.write(textwrap.indent(json.dumps(record, indent=2), "  "))
+            empty = False
+        file.write("[]" if empty else "\n]")
+
+    return path
+
+
+def read_base_examples(safe: bool, domain: Domain = None):
+    """
+    reads safe/unsafe base scenarios and lazily yields parsed scenarios.
     use safe=True for safe scenarios; safe=False for unsafe scenarios.
     """
-    examples = json.load(
-        open(f"./data/safetext/{safety_conditional(safe)}_samples.json", "r")
-    )
+    examples = read_records(f"./data/safetext/{safety_conditional(safe)}_samples.json")
 
     if domain == Domain.ALL.value or domain is None:
         return examples
@@ -137,16 +264,13 @@ def read_foveated_examples(
     model_class: str,
     model_variant: str,
     safe: bool,
-) -> list:
+):
     """
-    reads safe/unsafe foveated scenarios and returns parsed scenarios in list format.
+    reads safe/unsafe foveated scenarios and lazily yields parsed scenarios.
     use safe=True for safe scenarios; safe=False for unsafe scenarios.
     """
-    return json.load(
-        open(
-            f"./data/{folder}/foveation_{model_class}_{model_variant}_{safety_conditional(safe)}.json",
-            "r",
-        )
+    return read_records(
+        f"./data/{folder}/foveation_{model_class}_{model_variant}_{safety_conditional(safe)}.json"
     )
 
 
@@ -156,16 +280,13 @@ def read_augmented_examples(
     model_variant: str,
     safe: bool,
     attribution_source: str,
-) -> list:
+):
     """
-    reads safe/unsafe augmented scenarios and returns parsed scenarios in list format.
+    reads safe/unsafe augmented scenarios and lazily yields parsed scenarios.
     use safe=True for safe scenarios; safe=False for unsafe scenarios.
     """
-    return json.load(
-        open(
-            f"./data/{folder}/attribution_{model_class}_{model_variant}_{safety_conditional(safe)}_{attribution_source}.json",
-            "r",
-        )
+    return read_records(
+        f"./data/{folder}/attribution_{model_class}_{model_variant}_{safety_conditional(safe)}_{attribution_source}.json"
     )
 
 
@@ -178,18 +299,76 @@ def read_contextualized_examples(
     baseline: bool,
     attribution_source: AttributionSource = None,
     num_sources: int = None,
-) -> list:
+):
     """
-    reads safe/unsafe contextualized scenarios and returns parsed scenarios in list format.
+    reads safe/unsafe contextualized scenarios and lazily yields parsed scenarios.
     use safe=True for safe scenarios; safe=False for unsafe scenarios.
     """
-    return json.load(
-        open(
-            f"./data/{folder}/{'baseline' if baseline else 'rationalization'}_{model_class}_{model_variant}_{safety_conditional(safe)}{'_snippet' + str(num_sources) if num_sources else ''}{'_' + attribution_source if attribution_source else ''}.json",
-            "r",
-        )
+    return read_records(
+        f"./data/{folder}/{'baseline' if baseline else 'rationalization'}_{model_class}_{model_variant}_{safety_conditional(safe)}{'_snippet' + str(num_sources) if num_sources else ''}{'_' + attribution_source if attribution_source else ''}.json"
+    )
+
+
+def find_contextualized_runs(folder: str, model_class: str, model_variant: str) -> list:
+    """
+    discovers the baseline/rationalization outputs of a model in './data/{folder}'.
+    returns one dict of read_contextualized_examples arguments per run:
+        baseline, safe, num_sources, attribution_source
+    """
+    pattern = re.compile(
+        rf"^(baseline|rationalization)_{re.escape(model_class)}_{re.escape(model_variant)}"
+        r"_(safe|unsafe)(?:_snippet(\d+))?(?:_([a-z_]+))?\.jsonl?$"
     )
 
+    # '.json' and '.jsonl' outputs of the same run are read as one (see read_records)
+    runs = dict()
+    for name in sorted(os.listdir(f"./data/{folder}")):
+        match = pattern.match(name)
+        if match is None:
+            continue
+
+        phase, safety, num_sources, attribution_source = match.groups()
+        run = {
+            "baseline": phase == "baseline",
+            "safe": safety == "safe",
+            "num_sources": int(num_sources) if num_sources else None,
+            "attribution_source": attribution_source,
+        }
+        runs[tuple(run.values())] = run
+
+    return list(runs.values())
+
+
+def write_csv_table(rows: list, columns: list, path: str) -> None:
+    """
+    writes rows (dicts) as a CSV table with the given columns; missing values are left blank
+    """
+    with open(path, "w", newline="") as file:
+        writer = csv.DictWriter(file, fieldnames=columns, extrasaction="ignore")
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def write_markdown_table(rows: list, columns: list, path: str) -> None:
+    """
+    writes rows (dicts) as a Markdown table with the given columns; floats are rounded to 4 places
+    """
+
+    def cell(value: any) -> str:
+        if value is None:
+            return ""
+        if isinstance(value, float):
+            return f"{value:.4f}"
+        return str(value)
+
+    with open(path, "w") as file:
+        file.write("| " + " | ".join(columns) + " |\n")
+        file.write("|" + "---|" * len(columns) + "\n")
+        for row in rows:
+            file.write(
+                "| " + " | ".join(cell(row.get(column)) for column in columns) + " |\n"
+            )
+
 
 def base_scenario(prompt: str, advice: str) -> str:
     """
@@ -212,21 +391,21 @@ def context_prompt(prompt: str, advice: str, few_shot: bool = True, k: int = 16)
     generates a context asking prompt given the prompt, action, and class of text.
     TODO
     """
-    global FEW_SHOT_FOVEATIONS
-    if few_shot and not FEW_SHOT_FOVEATIONS:
-        FEW_SHOT_FOVEATIONS = _read_few_shot_foveations(k)
+    prefix = few_shot_prefix(PromptTemplate.FOVEATION, k) if few_shot else ""
 
-    return f"""{FEW_SHOT_FOVEATIONS if few_shot else ""}Q: To answer, "{base_scenario(prompt, advice)}" what do we first need context about?\nA:"""
+    return f"""{prefix}Q: To answer, "{base_scenario(prompt, advice)}" what do we first need context about?\nA:"""
 
 
-def augment_snippets(snippets: list, num_sources: int) -> str:
+def augment_snippets(
+    snippets: list, num_sources: int, max_chars: int = SNIPPET_MAX_CHARS
+) -> str:
     """
-    returns data augmentation of top k snippets
+    returns data augmentation of top k snippets, each truncated to max_chars characters
     applies summarization when summarize = True
     """
     return "; ".join(
         [
-            f"""{_extract_source(s["source"])}: {s["content"][:600]}"""
+            f"""{_extract_source(s["source"])}: {s["content"][:max_chars]}"""
             for s in snippets[:num_sources]
         ]
     )
@@ -238,13 +417,13 @@ def chat_reasoning_prompt(
     """
     generates an explanation-asking prompt given the prompt, action, and type of text.
     """
-    global CHAT_FEW_SHOT_EXPLANATIONS
-    if few_shot and not CHAT_FEW_SHOT_EXPLANATIONS:
-        CHAT_FEW_SHOT_EXPLANATIONS = _chat_few_shot_explanations(
-            augment=False, num_examples=num_examples
-        )
+    messages = (
+        few_shot_prefix(PromptTemplate.CHAT_EXPLANATION, num_examples)
+        if few_shot
+        else list()
+    )
 
-    return CHAT_FEW_SHOT_EXPLANATIONS + [
+    return messages + [
         {
             "role": "system",
             "content": f"""Q: {base_scenario(prompt=prompt, advice=advice)}""",
@@ -253,18 +432,25 @@ def chat_reasoning_prompt(
 
 
 def baseline_reasoning_prompt(
-    prompt: str, advice: str, few_shot=True, num_examples: int = 4
+    prompt: str,
+    advice: str,
+    few_shot=True,
+    num_examples: int = 4,
+    example_indices: tuple = None,
 ) -> str:
     """
     generates an explanation-asking prompt given the prompt, action, and type of text.
+    use example_indices to pick the few-shot examples (see select_few_shot_examples).
     """
-    global FEW_SHOT_EXPLANATIONS
-    if few_shot and not FEW_SHOT_EXPLANATIONS:
-        FEW_SHOT_EXPLANATIONS = _read_few_shot_explanations(
-            augment=False, num_examples=num_examples
+    prefix = (
+        few_shot_prefix(
+            PromptTemplate.EXPLANATION, num_examples, example_indices=example_indices
         )
+        if few_shot
+        else ""
+    )
 
-    return f"""{FEW_SHOT_EXPLANATIONS if few_shot else ""}Q: {base_scenario(prompt=prompt, advice=advice)}\nA:"""
+    return f"""{prefix}Q: {base_scenario(prompt=prompt, advice=advice)}\nA:"""
 
 
 def contextualized_reasoning_prompt(
@@ -274,16 +460,242 @@ def contextualized_reasoning_prompt(
     num_sources: int,
     few_shot: bool = True,
     num_examples: int = 16,
+    example_indices: tuple = None,
 ) -> str:
     """
     generates an explanation-asking prompt given the prompt, advice, foveation, context, and type of text.
-    """
-    global FEW_SHOT_AUGMENTATIONS
-    if few_shot and not FEW_SHOT_AUGMENTATIONS:
-        FEW_SHOT_AUGMENTATIONS = _read_few_shot_explanations(
-            augment=True,
-            num_examples=num_examples,
+    use example_indices to pick the few-shot examples (see select_few_shot_examples).
+    """
+    prefix = (
+        few_shot_prefix(
+            PromptTemplate.AUGMENTED_EXPLANATION,
+            num_examples,
+            num_sources,
+            example_indices,
+        )
+        if few_shot
+        else ""
+    )
+
+    return (
+        f"""{prefix}{context}\nQ: {base_scenario(prompt=prompt, advice=advice)}\nA:"""
+    )
+
+
+def budgeted_reasoning_prompt(
+    prompt: str,
+    advice: str,
+    snippets: list,
+    num_sources: int,
+    token_budget: int,
+    num_examples: int = 16,
+    example_indices: tuple = None,
+    context: str = None,
+) -> dict:
+    """
+    packs a contextualized reasoning prompt into token_budget GPT-2 tokens.
+    keeps the full snippets with as many few-shot examples (up to num_examples) as fit;
+    with example_indices, the least relevant selected examples are dropped first.
+    if the prompt does not fit even without examples, the snippets are shortened until it does.
+    a fixed context (e.g., the error of a failed attribution) is used as is instead of the snippets.
+    returns {"prompt", "context", "num_examples", "prompt_tokens"}; prompt_tokens exceeds token_budget
+    only when the scenario (or a fixed context) does not fit on its own.
+    """
+
+    def pack(k: int, max_chars: int = SNIPPET_MAX_CHARS) -> dict:
+        packed_context = (
+            context
+            if context is not None
+            else augment_snippets(
+                snippets, num_sources=num_sources, max_chars=max_chars
+            )
+        )
+        packed = contextualized_reasoning_prompt(
+            prompt=prompt,
+            advice=advice,
+            context=packed_context,
             num_sources=num_sources,
+            few_shot=k > 0,
+            num_examples=k,
+            example_indices=example_indices,
+        )
+        return {
+            "prompt": packed,
+            "context": packed_context,
+            "num_examples": k,
+            "prompt_tokens": num_tokens(packed),
+        }
+
+    def prefix_tokens(k: int) -> int:
+        prefix = few_shot_prefix(
+            PromptTemplate.AUGMENTED_EXPLANATION, k, num_sources, example_indices
         )
 
-    return f"""{FEW_SHOT_AUGMENTATIONS if few_shot else ""}{context}\nQ: {base_scenario(prompt=prompt, advice=advice)}\nA:"""
+        # fixed few-shot prefixes repeat across samples, so only their token counts are memoized
+        if example_indices is None:
+            return count_tokens([prefix])[0]
+        return num_tokens(prefix)
+
+    question = pack(0)
+    k = num_examples
+    while k > 0 and prefix_tokens(k) + question["prompt_tokens"] > token_budget:
+        k -= 1
+
+    # tokens can merge across the prefix boundary, so confirm with the packed prompt
+    packed = pack(k) if k > 0 else question
+    while packed["prompt_tokens"] > token_budget and k > 0:
+        k -= 1
+        packed = pack(k) if k > 0 else question
+    if packed["prompt_tokens"] <= token_budget or context is not None:
+        return packed
+
+    # binary search for the longest snippets that fit without examples
+    low, high = 0, SNIPPET_MAX_CHARS
+    best = pack(0, 0)
+    while low <= high:
+        max_chars = (low + high) // 2
+        candidate = pack(0, max_chars)
+        if candidate["prompt_tokens"] <= token_budget:
+            best, low = candidate, max_chars + 1
+        else:
+            high = max_chars - 1
+
+    return best
+
+
+@lru_cache(maxsize=None)
+def load_few_shot_index():
+    """
+    returns the nearest neighbour index over the few-shot rationalization scenarios.
+    it is persisted at FEW_SHOT_INDEX_PATH and rebuilt whenever the few-shot file changes.
+    """
+    from util.retrieval import VectorIndex, content_hash
+
+    with open("./data/few_shot/rationalization.json", "rb") as file:
+        fingerprint = content_hash(file.read())
+
+    if os.path.exists(FEW_SHOT_INDEX_PATH):
+        index = VectorIndex.load(FEW_SHOT_INDEX_PATH)
+        if index.fingerprint == fingerprint:
+            return index
+
+    examples = _read_few_shot_file("rationalization")
+    index = VectorIndex.build(
+        [base_scenario(prompt=e["prompt"], advice=e["advice"]) for e in examples],
+        fingerprint=fingerprint,
+    )
+    index.save(FEW_SHOT_INDEX_PATH)
+    return index
+
+
+def few_shot_pool_size() -> int:
+    """
+    returns the number of few-shot rationalization examples select_few_shot_examples chooses from
+    """
+    return len(_read_few_shot_file("rationalization"))
+
+
+def select_few_shot_examples(samples: list, k: int) -> list:
+    """
+    selects the k few-shot rationalization examples most similar to each sample's scenario,
+    scoring every sample against the few-shot index at once.
+    returns one tuple of example indices per sample, most similar first.
+    with k at least few_shot_pool_size(), every sample gets the whole pool, only reordered.
+    """
+    queries = [base_scenario(prompt=s["prompt"], advice=s["advice"]) for s in samples]
+    return [
+        tuple(int(i) for i in row) for row in load_few_shot_index().top_k(queries, k)
+    ]
+
+
+def _snippet_query(example: dict) -> str:
+    """
+    returns the text snippets of an attributed example are ranked against: its foveation, or else its scenario
+    foveations are stored as strings or, for failed requests, error records; completion lists
+    (i.e., [{"completion": ...}]) only appear in older outputs and are read defensively
+    """
+    foveation = example.get("foveation")
+    if isinstance(foveation, list) and foveation and isinstance(foveation[0], dict):
+        foveation = foveation[0].get("completion")
+
+    if isinstance(foveation, str) and foveation.strip():
+        return foveation
+    return base_scenario(prompt=example["prompt"], advice=example["advice"])
+
+
+def _has_snippets(example: dict) -> bool:
+    return isinstance(example.get("attribution"), list)
+
+
+def _rerank_chunk(examples: list, bm25) -> list:
+    """
+    reranks the snippets of a chunk of attributed examples, scoring every snippet of the chunk at once
+    """
+    from util.retrieval import jaccard_estimates, minhash_signatures
+
+    snippets, owners = list(), list()
+    for i, example in enumerate(examples):
+        if _has_snippets(example):
+            snippets.extend(example["attribution"])
+            owners.extend([i] * len(example["attribution"]))
+
+    contents = [snippet["content"] for snippet in snippets]
+    scores = bm25.score(
+        [_snippet_query(example) for example in examples], contents, owners
+    )
+    signatures = minhash_signatures(contents)
+
+    start = 0
+    for i, example in enumerate(examples):
+        if not _has_snippets(example):
+            continue
+
+        # greedily keep the best scoring snippets, skipping crowded domains and near-duplicates of kept snippets
+        candidates = range(start, start + len(example["attribution"]))
+        start += len(example["attribution"])
+        kept, domains = list(), dict()
+        for j in sorted(candidates, key=lambda j: -scores[j]):
+            domain = _extract_source(snippets[j]["source"])
+            if domains.get(domain, 0) >= MAX_SNIPPETS_PER_DOMAIN:
+                continue
+            if (
+                kept
+                and jaccard_estimates(signatures[j], signatures[kept]).max()
+                >= NEAR_DUPLICATE_THRESHOLD
+            ):
+                continue
+
+            kept.append(j)
+            domains[domain] = domains.get(domain, 0) + 1
+
+        examples[i] = {**example, "attribution": [snippets[j] for j in kept]}
+
+    return examples
+
+
+def rerank_attributed_examples(read_examples):
+    """
+    lazily yields attributed examples with their snippets deduplicated and reranked before augmentation:
+    snippets are ordered by BM25 relevance to the example's foveation, keeping at most MAX_SNIPPETS_PER_DOMAIN
+    per domain and dropping near-duplicates of better snippets (by MinHash estimated shingle overlap).
+    read_examples returns a fresh iterator over the examples; they are read twice, once for the corpus statistics
+    of the whole file and once to rerank RERANK_CHUNK_SIZE examples at a time.
+    """
+    from util.retrieval import BM25
+
+    bm25 = BM25()
+    chunk = list()
+    for example in read_examples():
+        if _has_snippets(example):
+            chunk.extend(snippet["content"] for snippet in example["attribution"])
+        if len(chunk) >= RERANK_CHUNK_SIZE:
+            bm25.add(chunk)
+            chunk = list()
+    bm25.add(chunk)
+
+    examples = iter(read_examples())
+    while True:
+        chunk = list(islice(examples, RERANK_CHUNK_SIZE))
+        if not chunk:
+            return
+        yield from _rerank_chunk(chunk, bm25)